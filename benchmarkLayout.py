@@ -0,0 +1,78 @@
+"""
+Benchmark of the two layouts of StackImages.Array:
+'pixel' : (dimX, dimY, n_images), the time sequence of each pixel is contiguous
+'frame' : (n_images, dimX, dimY), each image is contiguous
+
+The throughput (in Mpixels/s) is measured for:
+frames : copy of all the images, one by one, as done by StackImages[n]
+sequences : convolution of the time sequences of single pixels
+switches : whole stack switch detection (getSwitchTimes)
+
+Usage:
+python benchmarkLayout.py [dimX dimY n_images]
+"""
+import sys
+import time
+import numpy as np
+import scipy.ndimage as nd
+import getSwitchTimes as gst
+
+def makeStack(dimX, dimY, n_images, layout):
+    """
+    Random stack of int16 with a step at half of the sequence
+    """
+    stack = np.random.randint(0, 50, (n_images, dimX, dimY)).astype(np.int16)
+    stack[n_images//2:] += 100
+    if layout == 'pixel':
+        stack = np.ascontiguousarray(np.transpose(stack, (1, 2, 0)))
+    return stack
+
+def bestTime(func, repeat=3):
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+def benchmark(dimX=500, dimY=500, n_images=200, n_sequences=2000):
+    kernel = np.array([-1]*5 + [1]*5)
+    kernel0 = np.array([-1]*5 + [0] + [1]*5)
+    n_pixels = float(dimX * dimY * n_images)
+    pixels = np.random.randint(0, dimX * dimY, n_sequences)
+    xs, ys = pixels // dimY, pixels % dimY
+    results = {}
+    for layout in ['pixel', 'frame']:
+        stack = makeStack(dimX, dimY, n_images, layout)
+        if layout == 'frame':
+            getFrame = lambda k: stack[k]
+            getSequence = lambda x, y: stack[:, x, y]
+            timeAxis = 0
+        else:
+            getFrame = lambda k: stack[:, :, k]
+            getSequence = lambda x, y: stack[x, y, :]
+            timeAxis = -1
+        def frames():
+            for k in range(n_images):
+                np.array(getFrame(k))
+        def sequences():
+            for x, y in zip(xs, ys):
+                nd.convolve1d(getSequence(x, y), kernel).argmin()
+        def switches():
+            gst.getSwitchTimesAndSteps(stack, kernel, kernel0, 'step', 'small', timeAxis=timeAxis)
+        results[layout] = [n_pixels / bestTime(frames) / 1e6,
+                           n_sequences * n_images / bestTime(sequences) / 1e6,
+                           n_pixels / bestTime(switches, 1) / 1e6]
+    print
+    print "Stack of %i images of %i x %i pixels (Mpixels/s)" % (n_images, dimX, dimY)
+    print "%-8s %12s %12s %12s" % ("layout", "frames", "sequences", "switches")
+    for layout in ['pixel', 'frame']:
+        print "%-8s %12.1f %12.1f %12.1f" % tuple([layout] + results[layout])
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4:
+        dimX, dimY, n_images = [int(arg) for arg in sys.argv[1:]]
+        benchmark(dimX, dimY, n_images)
+    else:
+        benchmark()
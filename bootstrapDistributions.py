@@ -0,0 +1,180 @@
+"""
+Bootstrap confidence bands of the distributions in log scale
+
+The values (as D_avalanches or D_cluster of StackImages) are resampled
+with replacement n_boot times, and the distribution is calculated
+for each resample with the bins of the whole set of values.
+The bin of each value is found once; each batch of resamples
+is a 2D matrix of indexes (n_resamples, n_values), and the histograms
+of all the resamples of the batch are calculated with a single np.bincount.
+The batches can be calculated in a pool of processes: each batch has its own
+seed, derived from the seed given, so the results do not depend on n_workers.
+The bands are the percentiles of the distributions of the resamples in each bin
+"""
+import multiprocessing as mp
+import numpy as np
+import getLogDistributions as gLD
+
+PERCENTILES = (2.5, 50., 97.5)
+# Maximum number of elements of the resample index matrix of a batch
+MAX_BATCH_ELEMENTS = 2**22
+
+_workerData = None
+
+def _getBatches(n_boot, n_values, batchSize=None):
+    if batchSize is None:
+        batchSize = max(1, MAX_BATCH_ELEMENTS // max(n_values, 1))
+    return [min(batchSize, n_boot - i) for i in range(0, n_boot, batchSize)]
+
+def _histogramBatch(binIndex, weights, n_bins, batch, seed, method='index'):
+    """
+    Histograms of batch resamples of the values with bins binIndex (-1 out of the bins),
+    and the sums of their weights in each bin (if weights is not None)
+    """
+    rnd = np.random.RandomState(seed)
+    n_values = len(binIndex)
+    if method == 'multinomial':
+        # The counts of the bins of a resample are multinomial
+        p = np.bincount(binIndex + 1, minlength=n_bins + 1) / float(n_values)
+        return rnd.multinomial(n_values, p, size=batch)[:, 1:], None
+    resample = rnd.randint(0, n_values, (batch, n_values))
+    index = binIndex[resample]
+    isIn = index >= 0
+    # Shift the bins of each resample to histogram all of them at once
+    index = (index + n_bins * np.arange(batch)[:, np.newaxis])[isIn]
+    counts = np.bincount(index, minlength=batch * n_bins).reshape(batch, n_bins)
+    if weights is None:
+        return counts, None
+    sums = np.bincount(index, weights=weights[resample][isIn], minlength=batch * n_bins)
+    return counts, sums.reshape(batch, n_bins)
+
+def _initWorker(binIndex, weights, n_bins):
+    global _workerData
+    _workerData = binIndex, weights, n_bins
+
+def _histogramBatchInWorker(args):
+    batch, seed, method = args
+    binIndex, weights, n_bins = _workerData
+    return _histogramBatch(binIndex, weights, n_bins, batch, seed, method)
+
+def _getHistograms(binIndex, weights, n_bins, n_boot, seed, n_workers, batchSize, method='index'):
+    """
+    Histograms (and sums of the weights) of n_boot resamples,
+    as arrays (n_boot, n_bins)
+    """
+    batches = _getBatches(n_boot, len(binIndex), batchSize)
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, len(batches))
+    if n_workers == 1:
+        results = [_histogramBatch(binIndex, weights, n_bins, batch, s, method) \
+                   for batch, s in zip(batches, seeds)]
+    else:
+        pool = mp.Pool(n_workers, initializer=_initWorker, initargs=(binIndex, weights, n_bins))
+        try:
+            results = pool.map(_histogramBatchInWorker, [(batch, s, method) for batch, s in zip(batches, seeds)])
+        finally:
+            pool.terminate()
+            pool.join()
+    counts = np.concatenate([c for c, s in results])
+    if weights is None:
+        return counts, None
+    return counts, np.concatenate([s for c, s in results])
+
+def bootstrapLogDistribution(values, n_boot=1000, log_step=0.2, first_point=None, last_point=None, \
+                             normed=True, percentiles=PERCENTILES, seed=None, n_workers=1, \
+                             batchSize=None, method='index'):
+    """
+    bootstrapLogDistribution(values, n_boot=1000, log_step=0.2, first_point=None, last_point=None,
+                             normed=True, percentiles=PERCENTILES, seed=None, n_workers=1)
+
+    Confidence bands of the distribution in log scale of the values
+    (as calculated by getLogDistributions.logDistribution)
+
+    Parameters:
+    ---------------
+    values : array-like
+        The values, as D_avalanches or D_cluster
+    n_boot : int
+        Number of resamples
+    log_step, first_point, last_point, normed :
+        as in logDistribution
+    percentiles : sequence
+        The percentiles (0-100) of the bands
+    seed : int, opt
+        Seed of the random resamples, for reproducible bands
+    n_workers : int, opt
+        Number of processes calculating the batches of resamples;
+        None uses all the CPU cores
+    batchSize : int, opt
+        Number of resamples histogrammed at once;
+        default limits the index matrix to MAX_BATCH_ELEMENTS
+    method : string
+        'index': resample the values with a matrix of indexes
+        'multinomial': draw the counts of the bins of each resample
+        from the multinomial distribution (same statistics, faster for many values)
+
+    Returns:
+    -----------
+    xbins : array of the center of the bins
+    yhist : the distribution of the values
+    bands : ndarray (len(percentiles), n_bins)
+        The percentiles of the distributions of the resamples
+    """
+    values = np.asarray(values)
+    if not first_point:
+        first_point = np.amin(values)
+    if not last_point:
+        last_point = np.amax(values)
+    xbins, bins = gLD.getLogBins(first_point, last_point, log_step)
+    xbins, yhist = gLD.logDistribution(values, normed=normed, bins=(xbins, bins))
+    n_bins = len(bins) - 1
+    counts, sums = _getHistograms(gLD.getBinIndex(values, bins), None, n_bins, n_boot, seed, n_workers, \
+                                  batchSize, method)
+    yhists = counts / (bins[1:] - bins[:-1])
+    if normed:
+        yhists = yhists / np.sum(yhists, axis=1)[:, np.newaxis]
+    bands = np.percentile(yhists, percentiles, axis=0)
+    return xbins, yhist, bands
+
+def bootstrapAverageLogDistribution(values, n_boot=1000, log_step=0.2, first_point=None, last_point=None, \
+                                    percentiles=PERCENTILES, seed=None, n_workers=1, batchSize=None):
+    """
+    bootstrapAverageLogDistribution(values, n_boot=1000, log_step=0.2, first_point=None, last_point=None,
+                                    percentiles=PERCENTILES, seed=None, n_workers=1)
+
+    Confidence bands of the <values> vs. xVariable in log scale
+    (as calculated by getLogDistributions.averageLogDistribution),
+    resampling the pairs (xValue, yValue)
+
+    Parameters:
+    ---------------
+    values : dict or ndarray
+        as in averageLogDistribution, i.e. the array of (D_avalanches, N_cluster)
+    n_boot, percentiles, seed, n_workers, batchSize :
+        as in bootstrapLogDistribution
+    log_step, first_point, last_point :
+        as in averageLogDistribution
+
+    Returns:
+    -----------
+    x : array of the center of the bins with at least a value
+    yAverage : the average value within the bins
+    bands : ndarray (len(percentiles), len(x))
+        The percentiles of the averages of the resamples
+        (the resamples without values in a bin are not considered)
+    """
+    xValues, yValues = gLD.getXYValues(values)
+    if not first_point:
+        first_point = np.amin(xValues)*0.99
+    if not last_point:
+        last_point = np.amax(xValues)*1.01
+    x, yAverage = gLD.averageLogDistribution(values, log_step, first_point, last_point)
+    xbins, bins = gLD.getLogBins(first_point, last_point, log_step)
+    binIndex = gLD.getBinIndex(xValues, bins)
+    n_bins = len(bins) - 1
+    counts, sums = _getHistograms(binIndex, np.asarray(yValues, dtype=np.float64), n_bins, n_boot, seed, \
+                                  n_workers, batchSize)
+    isValue = np.bincount(binIndex[binIndex >= 0], minlength=n_bins) > 0
+    counts, sums = counts[:, isValue], sums[:, isValue]
+    averages = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    bands = np.array([np.nanpercentile(averages, q, axis=0) for q in percentiles])
+    return x, yAverage, bands
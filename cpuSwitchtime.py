@@ -0,0 +1,151 @@
+"""
+CPU implementation of gpuSwitchtime_v1.gpuSwitchtime
+
+The stack is mirrored at the first and last elements and convolved
+with the same origin rules of the CUDA kernel findconvolve1d,
+and the switch is found as in the CUDA kernel findmin,
+so the results are identical to the GPU calculation.
+The backend is selected between:
+'numpy' : vectorized calculation with numpy (default)
+'numba' : compiled loops, if numba is available
+'cuda' : the GPU calculation with pycuda (gpuSwitchtime_v1)
+"""
+import numpy
+import time
+
+try:
+    import numba
+    isNumba = True
+except ImportError:
+    isNumba = False
+
+# Maximum size (in bytes) of the convolution calculated at once by numpy
+MAX_CHUNK_BYTES = 2**28
+
+def getKernel(usekernel):
+    """
+    Return the kernel and its origin as used by gpuSwitchtime
+
+    Parameters:
+    ---------------
+    usekernel : string or sequence
+        step = [1]*5 +[-1]*5
+        zero = [1]*5 +[0] + [-1]*5
+        or the sequence of the kernel values
+    """
+    if not isinstance(usekernel, basestring):
+        kernel = [int(k) for k in usekernel]
+    elif usekernel == "step":
+        kernel = [1]*5 + [-1]*5
+    elif usekernel == "zero":
+        kernel = [1]*5 + [0] + [-1]*5
+    else:
+        raise ValueError("Kernel %s not available" % usekernel)
+    if len(kernel) % 2 == 0:
+        origin = -1
+    else:
+        origin = 0
+    return kernel, origin
+
+def mirrorStack(stack, stepsize, origin):
+    """
+    Mirror the first and last elements of the stack along the first axis,
+    as done before the call of the CUDA kernel findconvolve1d
+    """
+    a1_start = stack[:(stepsize//2 + origin)][::-1]
+    a2_end = stack[-(stepsize - (stepsize//2 + origin) - 1):][::-1]
+    return numpy.concatenate((a1_start, stack, a2_end), axis=0)
+
+def _switchtimeNumpy(stack, kernel, origin):
+    """
+    Vectorized calculation of the switch,
+    done on chunks of rows to limit the memory used
+    """
+    dim_z, dim_y, dim_x = stack.shape
+    kernel2 = numpy.array(kernel[::-1], dtype=numpy.int32)
+    switch = numpy.zeros((dim_y, dim_x), dtype=numpy.int32)
+    rows = max(1, MAX_CHUNK_BYTES // (8 * dim_z * dim_x))
+    for y0 in range(0, dim_y, rows):
+        amod = mirrorStack(stack[:, y0:y0+rows], len(kernel), origin)
+        convolution = numpy.zeros((dim_z,) + amod.shape[1:], dtype=numpy.int32)
+        for j, k in enumerate(kernel2):
+            if k:
+                convolution += amod[j:j+dim_z] * k
+        # As in findmin, the min starts from 4294967295, i.e. -1 as a C int:
+        # the switch of the pixels whose convolution never goes below -1 stays at 0
+        sw = convolution.argmin(axis=0).astype(numpy.int32)
+        sw[convolution.min(axis=0) >= -1] = 0
+        switch[y0:y0+rows] = sw
+    return switch
+
+if isNumba:
+    @numba.jit(nopython=True)
+    def _findSwitchNumba(amod, kernel2, switch):
+        dim_z = amod.shape[0] - kernel2.shape[0] + 1
+        dim_y, dim_x = switch.shape
+        minimum = numpy.empty((dim_y, dim_x), dtype=numpy.int32)
+        minimum[:, :] = -1
+        for idz in range(dim_z):
+            for idy in range(dim_y):
+                for idx in range(dim_x):
+                    value = 0
+                    for j in range(kernel2.shape[0]):
+                        value += amod[idz + j, idy, idx] * kernel2[j]
+                    value = numpy.int32(value)
+                    if value < minimum[idy, idx]:
+                        minimum[idy, idx] = value
+                        switch[idy, idx] = idz
+
+def _switchtimeNumba(stack, kernel, origin):
+    """
+    Calculation of the switch with compiled loops,
+    following findconvolve1d and findmin
+    """
+    if not isNumba:
+        raise ImportError("numba is not available: use backend='numpy'")
+    dim_z, dim_y, dim_x = stack.shape
+    kernel2 = numpy.array(kernel[::-1], dtype=numpy.int32)
+    switch = numpy.zeros((dim_y, dim_x), dtype=numpy.int32)
+    amod = mirrorStack(stack, len(kernel), origin)
+    _findSwitchNumba(amod, kernel2, switch)
+    return switch
+
+def switchtime(stack, usekernel, backend='numpy', device=None):
+    """
+    Return a matrix with the positions of a step in a sequence for each pixel,
+    as gpuSwitchtime
+
+    Parameters:
+    ---------------
+    stack : 3D Array of images, as (dim_z, dim_y, dim_x),
+        converted to int32 as required by the GPU
+
+    usekernel : string or sequence
+        step = [1]*5 +[-1]*5
+        zero = [1]*5 +[0] + [-1]*5
+        or the sequence of the kernel values
+
+    backend : string
+        'numpy', 'numba' or 'cuda'
+
+    device: Set the GPU device to use with the 'cuda' backend
+
+    Returns:
+    -----------
+    switch : 2D array (dim_y, dim_x) of int32 of the switch positions
+    t : time of the calculation (s)
+    """
+    stack = numpy.ascontiguousarray(stack, dtype=numpy.int32)
+    dim_z, dim_y, dim_x = stack.shape
+    kernel, origin = getKernel(usekernel)
+    if backend == 'cuda':
+        import gpuSwitchtime_v1
+        return gpuSwitchtime_v1.gpuSwitchtime(stack, dim_x, dim_y, dim_z, kernel, device)
+    t1 = time.time()
+    if backend == 'numpy':
+        switch = _switchtimeNumpy(stack, kernel, origin)
+    elif backend == 'numba':
+        switch = _switchtimeNumba(stack, kernel, origin)
+    else:
+        raise ValueError("Backend %s not available" % backend)
+    return switch, time.time() - t1
@@ -0,0 +1,132 @@
+"""
+Export of the differences between consecutive images of a stack
+
+The differences of a chunk of frames are calculated at once (np.diff along
+the time axis), and each difference is rescaled to 0-255 with its own
+min and max (as StackImages._imDiff), calculated for all the chunk together.
+The images are encoded and written by a pool of threads while
+the next chunk is calculated. The differences can also be saved
+in a single multi-page TIFF, or as a 3D array in a .npy file
+"""
+import os
+import numpy as np
+from multiprocessing.pool import ThreadPool
+try:
+    from PIL import Image, TiffImagePlugin
+except ImportError:
+    import Image, TiffImagePlugin
+
+FORMATS = ['tif', 'multipage', 'npy']
+
+def normalizeDiffs(diffs, invert=False):
+    """
+    Rescale each difference (along the first axis) between 0 and 255,
+    with the min and the max of the difference, as uint8
+
+    Parameters:
+    ---------------
+    diffs : ndarray (n_diffs, dimX, dimY) of int
+        The differences between the images
+    invert : bool
+        Invert black and white grey levels
+    """
+    if invert:
+        diffs = -diffs
+    axes = tuple(range(1, diffs.ndim))
+    imMin = diffs.min(axis=axes, keepdims=True)
+    imMax = diffs.max(axis=axes, keepdims=True)
+    span = np.maximum(imMax - imMin, 1).astype(np.int64)
+    return ((diffs - imMin) * 255 // span).astype(np.uint8)
+
+def getDiffs(getFrames, k0, k1, invert=False):
+    """
+    Rescaled differences between the frames k+1 and k, for k0 <= k < k1,
+    where getFrames(k0, k1) returns the frames from k0 to k1-1 as (n, dimX, dimY)
+    """
+    frames = np.asarray(getFrames(k0, k1 + 1), dtype=np.int32)
+    return normalizeDiffs(np.diff(frames, axis=0), invert)
+
+def _saveImage(args):
+    im, fileName = args
+    Image.fromarray(np.ascontiguousarray(im)).save(fileName)
+
+def exportDiffs(getFrames, imageNumbers, outDir, fileFormat='tif', invert=False, n_workers=4, chunkSize=32):
+    """
+    exportDiffs(getFrames, imageNumbers, outDir, fileFormat='tif', invert=False, n_workers=4, chunkSize=32)
+
+    Save the differences between the consecutive images of a sequence
+
+    Parameters:
+    ---------------
+    getFrames : function
+        getFrames(k0, k1) returns the images from index k0 to k1-1
+        as an array (k1-k0, dimX, dimY)
+    imageNumbers : sequence
+        The numbers of the images of the sequence
+    outDir : string
+        The directory of the files
+    fileFormat : string
+        'tif': a file imDiff_j_i.tif for each difference between the image j and i
+        'multipage': a single multi-page TIFF imDiff_first-last.tif
+        'npy': a single array (n_diffs, dimX, dimY) of uint8 in imDiff_first-last.npy
+    invert : bool
+        Invert black and white grey levels
+    n_workers : int
+        Number of threads writing the 'tif' files
+    chunkSize : int
+        Number of differences calculated at once
+
+    Returns:
+    -----------
+    fileNames : list of the files written
+    """
+    if fileFormat not in FORMATS:
+        raise ValueError("Format %s not available" % fileFormat)
+    n_diffs = len(imageNumbers) - 1
+    if n_diffs < 1:
+        raise ValueError("At least two images are needed")
+    if not os.path.isdir(outDir):
+        os.mkdir(outDir)
+    rangeName = os.path.join(outDir, "imDiff_%i-%i" % (imageNumbers[0], imageNumbers[-1]))
+    fileNames = []
+    if fileFormat == 'tif':
+        pool = ThreadPool(max(1, n_workers))
+        pending = None
+    elif fileFormat == 'multipage':
+        fileNames.append(rangeName + ".tif")
+        tiff = TiffImagePlugin.AppendingTiffWriter(fileNames[0], True)
+    else:
+        fileNames.append(rangeName + ".npy")
+        out = None
+    try:
+        for k0 in range(0, n_diffs, chunkSize):
+            k1 = min(k0 + chunkSize, n_diffs)
+            diffs = getDiffs(getFrames, k0, k1, invert)
+            if fileFormat == 'tif':
+                names = [os.path.join(outDir, "imDiff_%i_%i.tif" % (imageNumbers[k + 1], imageNumbers[k])) \
+                         for k in range(k0, k1)]
+                fileNames.extend(names)
+                # Wait for the previous chunk, so at most two chunks are in memory
+                if pending is not None:
+                    pending.get()
+                pending = pool.map_async(_saveImage, zip(diffs, names))
+            elif fileFormat == 'multipage':
+                for im in diffs:
+                    Image.fromarray(im).save(tiff)
+                    tiff.newFrame()
+            else:
+                if out is None:
+                    out = np.lib.format.open_memmap(fileNames[0], 'w+', np.uint8, (n_diffs,) + diffs.shape[1:])
+                out[k0:k1] = diffs
+        if fileFormat == 'tif' and pending is not None:
+            pending.get()
+    finally:
+        if fileFormat == 'tif':
+            pool.close()
+            pool.join()
+        elif fileFormat == 'multipage':
+            tiff.close()
+        elif out is not None:
+            out.flush()
+            del out
+    return fileNames
@@ -0,0 +1,121 @@
+"""
+Filtering of a stack of images as a single volume
+
+The frames of a chunk of the stack are filtered with a single call,
+giving to the filter a parameter for each axis (zero along the time axis),
+so the results are the same of the filter applied image by image.
+'gauss' and 'median' can also filter along the time axis (sigmaTime):
+in this case the chunks are read with a halo of frames on each side.
+'fftgauss' is a Gaussian filter calculated with the real FFT
+of a batch of images (with periodic boundaries)
+"""
+import numpy as np
+import scipy.ndimage as nd
+
+# Filters calculated on the whole chunk, with a parameter for each axis
+VOLUME_FILTERS = ['gauss', 'fouriergauss', 'median', 'fftgauss']
+# Filters which can be applied along the time axis
+TIME_FILTERS = ['gauss', 'median']
+
+def fftGaussianFilter(image, sigma, axes=(-2, -1)):
+    """
+    Gaussian filter calculated in the Fourier space
+    with the real FFT along the axes of the images
+
+    Parameters:
+    ---------------
+    image : ndarray
+        An image or a 3D batch of images
+    sigma : scalar or sequence
+        The sigma of the Gaussian kernel, for each axis of the image
+    axes : tuple
+        The two axes of the images
+    """
+    axes = [axis % image.ndim for axis in axes]
+    shape = [image.shape[axis] for axis in axes]
+    F = np.fft.rfftn(image, axes=axes)
+    F = nd.fourier_gaussian(F, sigma, n=shape[-1], axis=axes[-1], output=F)
+    return np.fft.irfftn(F, s=shape, axes=axes)
+
+def _getAxesParameter(value, valueTime, ndim, timeAxis):
+    """
+    Parameter of the filter for each axis of the volume
+    """
+    timeAxis = timeAxis % ndim
+    if np.isscalar(value):
+        value = [value] * (ndim - 1)
+    value = list(value)
+    value.insert(timeAxis, valueTime)
+    return value
+
+def getHalo(filtering, sigmaTime, truncate=4.0):
+    """
+    Number of frames needed on each side of a chunk
+    to filter it along the time axis
+    """
+    if not sigmaTime:
+        return 0
+    if filtering == 'gauss':
+        return int(truncate * float(sigmaTime) + 0.5)
+    if filtering == 'median':
+        return int(sigmaTime) // 2
+    raise ValueError("Filter %s not available along the time axis" % filtering)
+
+def filterVolume(volume, filtering, sigma, timeAxis=-1, sigmaTime=None, output=None, filters=None):
+    """
+    filterVolume(volume, filtering, sigma, timeAxis=-1, sigmaTime=None, output=None)
+
+    Filter a chunk of frames as a single array
+
+    Parameters:
+    ---------------
+    volume : ndarray
+        3D array of the frames, with the time along timeAxis
+    filtering, sigma :
+        as in StackImages
+    timeAxis : int
+        The axis of the time, -1 or 0
+    sigmaTime : scalar, opt
+        'gauss': standard deviation along the time axis
+        'median': size of the filter along the time axis
+    output : ndarray, opt
+        Preallocated array for the results;
+        for 'gauss' and 'median' it must have the dtype of volume,
+        as for the filter applied to each image
+    filters : dict, opt
+        The filters applied image by image (as in visualBarkh),
+        used for the filters not in VOLUME_FILTERS
+
+    Returns:
+    -----------
+    output : the filtered volume
+    """
+    if sigmaTime and filtering not in TIME_FILTERS:
+        raise ValueError("Filter %s not available along the time axis" % filtering)
+    ndim = volume.ndim
+    if filtering == 'gauss':
+        sigmas = _getAxesParameter(sigma, sigmaTime or 0, ndim, timeAxis)
+        return nd.gaussian_filter(volume, sigmas, output=output)
+    elif filtering == 'median':
+        sizes = _getAxesParameter(sigma, sigmaTime or 1, ndim, timeAxis)
+        return nd.median_filter(volume, size=sizes, output=output)
+    elif filtering == 'fouriergauss':
+        sigmas = _getAxesParameter(sigma, 0, ndim, timeAxis)
+        return nd.fourier_gaussian(volume, sigmas, output=output)
+    elif filtering == 'fftgauss':
+        sigmas = _getAxesParameter(sigma, 0, ndim, timeAxis)
+        axes = [axis for axis in range(ndim) if axis != timeAxis % ndim]
+        result = fftGaussianFilter(volume, sigmas, axes)
+        if output is None:
+            return result
+        output[:] = result
+        return output
+    # Filters depending on the whole image: apply them image by image
+    if output is None:
+        output = np.empty(volume.shape, dtype=np.float64)
+    for k in range(volume.shape[timeAxis]):
+        if timeAxis % ndim == 0:
+            output[k] = filters[filtering](volume[k], sigma)
+        else:
+            output[:,:,k] = filters[filtering](volume[:,:,k], sigma)
+    return output
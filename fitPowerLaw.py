@@ -0,0 +1,253 @@
+"""
+Maximum likelihood fits of the distributions of avalanche and cluster sizes
+
+Discrete power law:
+    p(x) = x**(-alpha) / zeta(alpha, xmin), for x >= xmin
+Discrete power law with exponential cutoff:
+    p(x) = x**(-alpha) * exp(-lambda * x) / C(alpha, lambda, xmin)
+
+xmin is chosen minimizing the Kolmogorov-Smirnov distance between
+the data and the fit above xmin, and the goodness of the fit is estimated
+with synthetic datasets (see A. Clauset, C. R. Shalizi, M. E. J. Newman,
+SIAM Review 51, 661 (2009)).
+The log-likelihood of the power law is calculated for a grid of alphas at once,
+with a table of log(zeta(alphas, xmin)) for each xmin; the tables are cached
+in a ZetaTable and reused during the scan of xmin and by the synthetic datasets
+"""
+import numpy as np
+import scipy.special as special
+import scipy.optimize as optimize
+import scipy.stats
+
+ALPHAS = np.arange(1.01, 6., 0.005)
+
+class ZetaTable:
+    """
+    Cache of log(zeta(alphas, xmin)) for the grid of alphas
+
+    Parameters:
+    ---------------
+    alphas : ndarray, opt
+        The grid of the exponents (> 1). Default is ALPHAS
+    """
+    def __init__(self, alphas=None):
+        if alphas is None:
+            alphas = ALPHAS
+        self.alphas = np.asarray(alphas, dtype=np.float64)
+        self._logZeta = {}
+
+    def getLogZeta(self, xmin):
+        if xmin not in self._logZeta:
+            self._logZeta[xmin] = np.log(special.zeta(self.alphas, xmin))
+        return self._logZeta[xmin]
+
+def _negLogLikelihood(alpha, n, sumLog, xmin):
+    return n * np.log(special.zeta(alpha, xmin)) + alpha * sumLog
+
+def _refineAlpha(alpha, step, n, sumLog, xmin):
+    """
+    Maximize the log-likelihood around the best alpha of the grid
+    """
+    result = optimize.minimize_scalar(_negLogLikelihood, bounds=(max(alpha - step, 1. + 1e-6), alpha + step), \
+                                      args=(n, sumLog, xmin), method='bounded')
+    return result.x
+
+def powerLawCdf(x, alpha, xmin):
+    """
+    Cumulative distribution P(X <= x) of the discrete power law
+    """
+    return 1. - special.zeta(alpha, np.asarray(x, dtype=np.float64) + 1) / special.zeta(alpha, xmin)
+
+def _ksDistance(values, cumCounts, start, alpha, xmin):
+    """
+    Kolmogorov-Smirnov distance between the values >= xmin and the power law,
+    calculated at the distinct values (values[start:]),
+    given the cumulative counts of the distinct values
+    """
+    below = start and cumCounts[start - 1]
+    ecdf = (cumCounts[start:] - below) / float(cumCounts[-1] - below)
+    return np.max(np.abs(ecdf - powerLawCdf(values[start:], alpha, xmin)))
+
+def fitPowerLaw(values, xmin=None, xmins=None, minTail=10, maxXmin=None, zetaTable=None):
+    """
+    fitPowerLaw(values, xmin=None, xmins=None, minTail=10, maxXmin=None, zetaTable=None)
+
+    Maximum likelihood fit of the discrete power law
+
+    Parameters:
+    ---------------
+    values : array-like
+        The sizes (integers >= 1), as D_avalanches or D_cluster
+    xmin : int, opt
+        Lower bound of the power law. If None, it is chosen between the xmins
+        minimizing the Kolmogorov-Smirnov distance
+    xmins : sequence, opt
+        The xmins to scan. Default are the distinct values
+        with at least minTail values above them (and not above maxXmin)
+    zetaTable : ZetaTable, opt
+        The cache of the zeta tables, to be shared between fits
+
+    Returns:
+    -----------
+    fit : dict
+        'alpha', 'sigma' (standard error of alpha), 'xmin',
+        'n_tail' (no. of values >= xmin), 'D' (Kolmogorov-Smirnov distance)
+        and 'loglikelihood'
+    """
+    if zetaTable is None:
+        zetaTable = ZetaTable()
+    alphas = zetaTable.alphas
+    step = alphas[1] - alphas[0]
+    x = np.asarray(values, dtype=np.float64)
+    # Distinct values, their counts and the sums of log(x) from each of them to the end
+    x, counts = np.unique(x[x >= 1], return_counts=True)
+    cumCounts = np.cumsum(counts)
+    tailSums = np.concatenate((np.cumsum((counts * np.log(x))[::-1])[::-1], [0.]))
+    n_values = cumCounts[-1]
+    if xmin is not None:
+        xmins = [xmin]
+    elif xmins is None:
+        xmins = x[n_values - cumCounts + counts >= minTail]
+        if maxXmin is not None:
+            xmins = xmins[xmins <= maxXmin]
+    if not len(xmins):
+        raise ValueError("Not enough values to fit")
+    best = None
+    # zeta(alpha, x + 1) of the distinct values for the alphas of the grid found in the scan
+    zetaValues = {}
+    for xm in xmins:
+        start = np.searchsorted(x, xm)
+        below = start and cumCounts[start - 1]
+        n, sumLog = n_values - below, tailSums[start]
+        # Log-likelihood on the grid of alphas
+        logZeta = zetaTable.getLogZeta(xm)
+        k = np.argmax(-n * logZeta - alphas * sumLog)
+        if k not in zetaValues:
+            zetaValues[k] = special.zeta(alphas[k], x + 1)
+        # Kolmogorov-Smirnov distance at the distinct values
+        ecdf = (cumCounts[start:] - below) / float(n)
+        D = np.max(np.abs(ecdf - 1. + zetaValues[k][start:] / np.exp(logZeta[k])))
+        if best is None or D < best[0]:
+            best = D, xm, alphas[k], n, sumLog, start
+    D, xmin, alpha, n, sumLog, start = best
+    alpha = _refineAlpha(alpha, step, n, sumLog, xmin)
+    # Standard error from the second derivative of the log-likelihood
+    h = 1e-4
+    f = [np.log(special.zeta(a, xmin)) for a in (alpha - h, alpha, alpha + h)]
+    sigma = 1. / np.sqrt(n * (f[0] - 2 * f[1] + f[2]) / h**2)
+    return {'alpha': alpha, 'sigma': sigma, 'xmin': xmin, 'n_tail': n, \
+            'D': _ksDistance(x, cumCounts, start, alpha, xmin), \
+            'loglikelihood': -_negLogLikelihood(alpha, n, sumLog, xmin)}
+
+def _logNormCutoff(alpha, lam, xmin, kmax):
+    """
+    log of the normalization C(alpha, lambda, xmin) of the power law with cutoff,
+    summed up to exp(-lambda * k) ~ exp(-50) (or kmax) plus the tail of the power law
+    """
+    K = int(min(xmin + 50. / lam, kmax))
+    k = np.arange(xmin, K + 1, dtype=np.float64)
+    s = np.sum(np.exp(-alpha * np.log(k) - lam * k))
+    if alpha > 1:
+        s += np.exp(-lam * (K + 1)) * special.zeta(alpha, K + 1)
+    return np.log(s)
+
+def fitPowerLawCutoff(values, xmin, alpha0=None, lambda0=None):
+    """
+    fitPowerLawCutoff(values, xmin, alpha0=None, lambda0=None)
+
+    Maximum likelihood fit of the discrete power law with exponential cutoff
+
+    Parameters:
+    ---------------
+    values : array-like
+        The sizes (integers >= 1)
+    xmin : int
+        Lower bound of the distribution, as found by fitPowerLaw
+    alpha0, lambda0 : float, opt
+        Initial values of the parameters
+
+    Returns:
+    -----------
+    fit : dict
+        'alpha', 'lambda', 'xmin', 'n_tail' and 'loglikelihood'
+    """
+    x = np.asarray(values, dtype=np.float64)
+    x = x[x >= xmin]
+    n, sumLog, sumX = len(x), np.sum(np.log(x)), np.sum(x)
+    kmax = max(10 * x.max(), 10**5)
+    if alpha0 is None:
+        alpha0 = 1.5
+    if lambda0 is None:
+        lambda0 = 1. / x.max()
+    def negLogLikelihood(params):
+        alpha, lam = params[0], np.exp(params[1])
+        return n * _logNormCutoff(alpha, lam, xmin, kmax) + alpha * sumLog + lam * sumX
+    result = optimize.minimize(negLogLikelihood, [alpha0, np.log(lambda0)], method='Nelder-Mead', \
+                               options={'xatol': 1e-6, 'fatol': 1e-8, 'maxiter': 2000})
+    alpha, lam = result.x[0], np.exp(result.x[1])
+    return {'alpha': alpha, 'lambda': lam, 'xmin': xmin, 'n_tail': n, 'loglikelihood': -result.fun}
+
+def likelihoodRatioCutoff(fit, fitCutoff):
+    """
+    Likelihood ratio test of the power law against the power law
+    with cutoff (nested models), fitted with the same xmin
+
+    Returns:
+    -----------
+    R : the log-likelihood ratio (> 0 favours the cutoff)
+    p : the p-value of the power law
+    """
+    R = fitCutoff['loglikelihood'] - fit['loglikelihood']
+    return R, scipy.stats.chi2.sf(2 * max(R, 0.), 1)
+
+def powerLawRandom(n, alpha, xmin, rnd=np.random):
+    """
+    Random values of the discrete power law,
+    with the approximation of Clauset et al. (eq. D.6)
+    """
+    r = rnd.uniform(size=n)
+    return np.floor((xmin - 0.5) * (1. - r)**(-1. / (alpha - 1.)) + 0.5)
+
+def goodnessOfFit(values, fit, n_boot=100, seed=None, minTail=10, maxXmin=None, zetaTable=None):
+    """
+    goodnessOfFit(values, fit, n_boot=100, seed=None, minTail=10, maxXmin=None, zetaTable=None)
+
+    p-value of the power law fit: synthetic datasets are drawn from the fit
+    above xmin and from the values below xmin, and fitted as the data
+    (with the scan of xmin); p is the fraction of datasets with
+    a Kolmogorov-Smirnov distance larger than the one of the data
+
+    Parameters:
+    ---------------
+    values : array-like
+        The sizes fitted
+    fit : dict
+        The result of fitPowerLaw
+    n_boot : int
+        Number of synthetic datasets (~2500 for a precision of 0.01 on p)
+    seed : int, opt
+        Seed of the random datasets
+    minTail, maxXmin, zetaTable :
+        as in fitPowerLaw; the zeta tables are shared by all the fits
+
+    Returns:
+    -----------
+    p : float
+        The p-value
+    Ds : ndarray
+        The Kolmogorov-Smirnov distances of the synthetic datasets
+    """
+    if zetaTable is None:
+        zetaTable = ZetaTable()
+    rnd = np.random.RandomState(seed)
+    x = np.asarray(values, dtype=np.float64)
+    x = x[x >= 1]
+    body = x[x < fit['xmin']]
+    n_total = len(x)
+    Ds = np.empty(n_boot)
+    for i in range(n_boot):
+        n_tail = rnd.binomial(n_total, fit['n_tail'] / float(n_total))
+        synthetic = np.concatenate((powerLawRandom(n_tail, fit['alpha'], fit['xmin'], rnd), \
+                                    body[rnd.randint(0, max(len(body), 1), n_total - n_tail)] if len(body) else []))
+        Ds[i] = fitPowerLaw(synthetic, minTail=minTail, maxXmin=maxXmin, zetaTable=zetaTable)['D']
+    return np.mean(Ds >= fit['D']), Ds
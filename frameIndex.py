@@ -0,0 +1,65 @@
+"""
+Index of the pixels switching at each frame
+
+The pixels are sorted by switch time once (as a CSR sparse matrix):
+the pixels switching at the k-th switch time times[k] are
+pixels[offsets[k]:offsets[k+1]], so the pixels of an avalanche
+are found in O(avalanche size), without comparing the whole image
+"""
+import numpy as np
+
+class FrameIndex:
+    """
+    Pixels (flat indexes) of each switch time
+
+    Parameters:
+    ---------------
+    switchTimes : ndarray
+        The switch times of the pixels (as StackImages._switchTimes)
+    """
+    def __init__(self, switchTimes):
+        switchTimes = np.asarray(switchTimes).ravel()
+        # Stable sort: the pixels of a frame are in increasing order
+        self.pixels = np.argsort(switchTimes, kind='mergesort')
+        self.times, counts = np.unique(switchTimes, return_counts=True)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def __len__(self):
+        return len(self.times)
+
+    def getSizes(self):
+        """
+        Number of pixels of each switch time
+        """
+        return np.diff(self.offsets)
+
+    def _getPosition(self, time):
+        k = np.searchsorted(self.times, time)
+        if k < len(self.times) and self.times[k] == time:
+            return k
+        return None
+
+    def getPixels(self, time):
+        """
+        Flat indexes of the pixels switching at time (empty if none)
+        """
+        k = self._getPosition(time)
+        if k is None:
+            return self.pixels[:0]
+        return self.pixels[self.offsets[k]:self.offsets[k+1]]
+
+    def mergeWithNext(self, time):
+        """
+        Move the pixels switching at time to time + 1
+        (as the switch times changed by StackImages.ghostbusters).
+        The pixels of two consecutive times are contiguous,
+        so only the offsets are changed
+        """
+        k = self._getPosition(time)
+        if k is None:
+            return
+        if k + 1 < len(self.times) and self.times[k+1] == time + 1:
+            self.times = np.delete(self.times, k)
+            self.offsets = np.delete(self.offsets, k + 1)
+        else:
+            self.times[k] = time + 1
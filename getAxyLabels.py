@@ -1,9 +1,69 @@
 import scipy
 import scipy.ndimage as nd
+import numpy as np
 import time
-import itertools
 
-def getAxyLabels(labels, imageDir="Left_to_right", edgeThickness=1, fraction=None):
+def getEdges(labels, imageDir="Left_to_right", edgeThickness=1):
+    """
+    Return the 4 edges (as 2D arrays of thickness edgeThickness)
+    of the image labels, ordered along imageDir: the edge where
+    the avalanches start, the opposite one, and the two lateral edges
+    """
+    et = edgeThickness
+    # Find first the 4 borders
+    # Definition good for "Left_to_right"
+    left = labels[0:et,:]
+    right = labels[-et:,:]
+    bottom = labels[:,0:et]
+    top = labels[:,-et:]
+    if imageDir=="Left_to_right":
+        lrbt = left, right, bottom, top
+    elif imageDir == "Right_to_left":
+        lrbt = right, left, top, bottom
+    elif imageDir == "Bottom_to_top":
+        lrbt = bottom, top, right, left
+    elif imageDir == "Top_to_bottom":
+        lrbt = top, bottom, left, right
+    else:
+        raise ValueError, "avalanche direction not defined"
+    return lrbt
+
+# Axy string of each bitmask: the first edge is the most significant bit
+AXY_STRINGS = scipy.array(["".join([str((code >> bit) & 1) for bit in (3, 2, 1, 0)]) for code in range(16)])
+
+def axyToString(codes):
+    """
+    Convert the Axy bitmasks (as given by getAxyLabels)
+    to the string codes ('0000', '1000', '1100', etc)
+    """
+    return AXY_STRINGS[np.asarray(codes, dtype=np.intp)]
+
+def getAxyBitmask(edgeCounts, sizes, fraction=None):
+    """
+    Axy bitmasks from the number of pixels of each cluster in each edge
+
+    Parameters:
+    ----------------
+    edgeCounts : sequence
+    The 4 arrays (ordered as given by getEdges) of the no. of pixels
+    of each cluster inside the edge
+
+    sizes : ndarray
+    The size of each cluster
+
+    fraction : float
+    as in getAxyLabels
+    """
+    if not fraction:
+        fraction = 0.
+    # Minimum no of pixels in an edge to set the cluster as touching
+    fraction_size = np.floor(fraction * np.asarray(sizes)).astype(np.int64) + 1
+    codes = np.zeros(len(sizes), dtype=np.uint8)
+    for bit, counts in zip((8, 4, 2, 1), edgeCounts):
+        codes |= np.where(counts >= fraction_size, bit, 0).astype(np.uint8)
+    return codes
+
+def getAxyLabels(labels, imageDir="Left_to_right", edgeThickness=1, fraction=None, asString=False):
     """
     Get the edges touched by clusters/avalanche
     given by a 2D array of 1's or 
@@ -28,41 +88,29 @@ def getAxyLabels(labels, imageDir="Left_to_right", edgeThickness=1, fraction=Non
     This is the minimum fraction of the size of the avalanche/cluster inside
     an edge (of thickness edgeThickness) with sets the avalanche/cluster
     as touching
+
+    asString : bool
+    If True, return the string codes ('0000', '1000', etc)
+    instead of the bitmasks
+
+    Returns:
+    -----------
+    array_Axy : ndarray
+    The Axy of the clusters 1, 2, ..., labels.max() as a bitmask (uint8):
+    bit 3 is set if the cluster touches the first edge (where the avalanches start),
+    bit 2 the opposite edge, bits 1 and 0 the lateral edges,
+    so that the string code of 9 is '1001'
     """
-    et = edgeThickness
-    if not fraction:
-        fraction = 0.
-    # Find first the 4 borders
-    # Definition good for "Left_to_right"
-    left = list(labels[0:et,:].flatten())
-    right = list(labels[-et:,:].flatten())
-    bottom = list(labels[:,0:et].flatten())
-    top = list(labels[:,-et:].flatten())
-    if imageDir=="Left_to_right":
-        lrbt = left, right, bottom, top
-    elif imageDir == "Right_to_left":
-        lrbt = right, left, top, bottom
-    elif imageDir == "Bottom_to_top":
-        lrbt = bottom, top, right, left
-    elif imageDir == "Top_to_bottom":
-        lrbt = top, bottom, left, right
-    else:
-        raise ValueError, "avalanche direction not defined"
-    # Find the sets
-    # Select the labels contained in the edges
-    #setLrbt = set(left+right+bottom+top)
-    setLrbt = set(itertools.chain(*lrbt))
-    # Remove the value 0 as it is not a cluster
-    setLrbt.remove(0)
-    maxLabel = labels.max()
-    # Prepare a list with all '0000' labels
-    list_Axy = ['0000']*maxLabel
-    # Search for the Axy except for the A00
-    for cluster in setLrbt: # iter over clusters touching the edges
-        fraction_size = int(fraction * nd.sum(labels == cluster)) + 1
-        list_Axy[cluster-1] = "".join([((edge.count(cluster) >= fraction_size) and '1' or '0') for edge in lrbt])
-        #pixels_on_the_edge = "/".join([str(edge.count(cluster)) for edge in lrbt])
-    return scipy.array(list_Axy)
+    labels = np.asarray(labels)
+    maxLabel = max(labels.max(), 0) if labels.size else 0
+    # Sizes and no. of pixels in each edge of all the clusters with a single scan
+    sizes = np.bincount(labels.ravel(), minlength=maxLabel+1)[1:]
+    edgeCounts = [np.bincount(edge.ravel(), minlength=maxLabel+1)[1:]
+                  for edge in getEdges(labels, imageDir, edgeThickness)]
+    array_Axy = getAxyBitmask(edgeCounts, sizes, fraction)
+    if asString:
+        return axyToString(array_Axy)
+    return array_Axy
         
 if __name__ == "__main__":
     startTime = time.time()
@@ -85,7 +133,7 @@ if __name__ == "__main__":
     print labels
     list_sizes = nd.sum(a, labels, range(1,n+1))
     array_sizes = scipy.array(list_sizes,dtype='int16')
-    array_Axy = getAxyLabels(labels,'Bottom_to_top', edgeThickness=1, fraction=0.5)
+    array_Axy = getAxyLabels(labels,'Bottom_to_top', edgeThickness=1, fraction=0.5, asString=True)
     for Axy in set(array_Axy):
         sizes = array_sizes[array_Axy==Axy] # Not bad...
         d[Axy] = scipy.concatenate((d.get(Axy,a0),sizes))
@@ -3,7 +3,6 @@ import scipy
 import scipy.stats
 from scipy import array
 import numpy as np
-import itertools
 
 def checkIfVoid(listValues):
     # Check the list of Values
@@ -32,7 +31,7 @@ def getLogBins(first_point, last_point, log_step):
     log_first_point = scipy.log10(first_point)
     log_last_point = scipy.log10(last_point)
     # Calculate the bins as required by the histogram function, i.e. the bins edges including the rightmost one
-    N_log_steps = scipy.floor((log_last_point-log_first_point)/log_step) + 1.
+    N_log_steps = int(scipy.floor((log_last_point-log_first_point)/log_step) + 1.)
     llp = N_log_steps * log_step + log_first_point
     bins_in_log_scale = np.linspace(log_first_point, llp, N_log_steps+1)
     bins = 10**bins_in_log_scale
@@ -40,26 +39,138 @@ def getLogBins(first_point, last_point, log_step):
     xbins = 10**center_of_bins_log_scale
     return xbins, bins
 
-def logDistribution(listValues, log_step=0.2, first_point=None, last_point=None, normed=True):
+def getBinIndex(values, bins):
+    """
+    Index of the bin [bins[i], bins[i+1]) of each value;
+    -1 for the values out of the bins
+    """
+    index = np.searchsorted(bins, values, side='right') - 1
+    index[index >= len(bins) - 1] = -1
+    return index
+
+def logHistogram(values, bins, weights=None):
+    """
+    Number of values (or sum of their weights) in each bin [bins[i], bins[i+1]),
+    as scipy.stats.histogram2 without the last (open) bin.
+    The values are not sorted nor copied
+    """
+    index = getBinIndex(np.asarray(values), bins)
+    isIn = index >= 0
+    if weights is not None:
+        weights = np.asarray(weights)[isIn]
+    return np.bincount(index[isIn], weights=weights, minlength=len(bins) - 1).astype(np.float64)
+
+def _normHistogram(yhist, bins, normed):
+    deltas = bins[1:]-bins[:-1]
+    yhist = yhist/deltas
+    if normed:
+        yhist = yhist/scipy.sum(yhist)
+    return yhist
+
+def logDistribution(listValues, log_step=0.2, first_point=None, last_point=None, normed=True, \
+                    weights=None, bins=None):
     """
     Calculate the distribution in log scale from a list of values
+
+    Parameters:
+    ----------------
+    listValues : array-like
+    The values (as the sizes of the avalanches)
+
+    weights : array-like, opt
+    The weight of each value (for instance the number of times it occurs)
+
+    bins : tuple, opt
+    The bins (xbins, bins) as given by getLogBins,
+    to reuse the same bins in many calls
+    (log_step, first_point and last_point are not used)
     """
     # Check the list of Values
     if not checkIfVoid(listValues):
         print("Error")
-    if not first_point:
-        first_point = scipy.amin(listValues)
-    if not last_point:
-        last_point = scipy.amax(listValues)
-    xbins, bins = getLogBins(first_point, last_point, log_step)
-    yhist = scipy.stats.stats.histogram2(listValues, bins)
-    deltas = bins[1:]-bins[:-1]
-    yhist = yhist[:-1]/deltas
-    if normed:
-        yhist = yhist/scipy.sum(yhist)
-    return xbins, yhist
+    listValues = np.asarray(listValues)
+    if bins is None:
+        if not first_point:
+            first_point = scipy.amin(listValues)
+        if not last_point:
+            last_point = scipy.amax(listValues)
+        xbins, bins = getLogBins(first_point, last_point, log_step)
+    else:
+        xbins, bins = bins
+    yhist = logHistogram(listValues, bins, weights)
+    return xbins, _normHistogram(yhist, bins, normed)
+
+def logDistributions(arrays, log_step=0.2, first_point=None, last_point=None, normed=True, \
+                     weights=None, bins=None):
+    """
+    Calculate the distributions in log scale of many arrays
+    with the same bins, with a single histogram of all the values
+
+    Parameters:
+    ----------------
+    arrays : dict or list
+    The arrays of values, as dictAxy['clus'] of StackImages
+
+    weights : dict or list, opt
+    The weights of the values of each array
+
+    log_step, first_point, last_point, normed, bins :
+    as in logDistribution; first_point and last_point are the min and max
+    of all the arrays if not given
+
+    Returns:
+    -----------
+    xbins : array of the center of the bins
+    yhists : dict or list (as arrays) of the distributions
+    """
+    if isinstance(arrays, dict):
+        keys = arrays.keys()
+        arrayList = [np.asarray(arrays[key]) for key in keys]
+        if weights is not None:
+            weights = [weights[key] for key in keys]
+    else:
+        arrayList = [np.asarray(values) for values in arrays]
+    if bins is None:
+        nonVoid = [values for values in arrayList if len(values)]
+        if not first_point:
+            first_point = min([scipy.amin(values) for values in nonVoid])
+        if not last_point:
+            last_point = max([scipy.amax(values) for values in nonVoid])
+        xbins, bins = getLogBins(first_point, last_point, log_step)
+    else:
+        xbins, bins = bins
+    n_bins = len(bins) - 1
+    # Histogram of all the arrays at once: the bins of the array k are shifted by k * n_bins
+    index = np.concatenate([getBinIndex(values, bins) for values in arrayList])
+    group = np.repeat(np.arange(len(arrayList)), [len(values) for values in arrayList])
+    isIn = index >= 0
+    if weights is not None:
+        weights = np.concatenate([np.asarray(w, dtype=np.float64) for w in weights])[isIn]
+    yhists = np.bincount(index[isIn] + group[isIn] * n_bins, weights=weights, \
+                         minlength=len(arrayList) * n_bins).astype(np.float64)
+    yhists = [_normHistogram(yhist, bins, normed) for yhist in yhists.reshape(len(arrayList), n_bins)]
+    if isinstance(arrays, dict):
+        return xbins, dict(zip(keys, yhists))
+    return xbins, yhists
     
-def averageLogDistribution(values, log_step=0.2, first_point=None, last_point=None):
+def getXYValues(values):
+    """
+    Return the arrays of the xValues and the yValues
+    of the values given to averageLogDistribution (a dict or a two columns array),
+    with an xValue for each yValue
+    """
+    if isinstance(values, dict):
+        yValues = [np.atleast_1d(values[key]) for key in values]
+        xValues = np.repeat(np.asarray(values.keys()), [len(y) for y in yValues])
+        return xValues, np.concatenate(yValues)
+    elif isinstance(values, np.ndarray):
+        return values[:, 0], values[:, 1]
+    else:
+        print("Values shape not recognized")
+        return None, None
+
+def averageLogDistribution(values, log_step=0.2, first_point=None, last_point=None, \
+                           returnStd=False, returnCounts=False):
     """
     calculates the <values> vs. xVariable in log scale
 
@@ -75,26 +186,24 @@ def averageLogDistribution(values, log_step=0.2, first_point=None, last_point=No
     values : ndarray
     Two columns array of xValues and yValues,
     to be rearranged as above
+
+    returnStd : bool
+    Also return the standard deviation of the values within the bin
+
+    returnCounts : bool
+    Also return the number of values within the bin
      
     Returns:
     center point of the bin, average value within the bin
+    (and the std, the number of values, if required),
+    for the bins with at least a value
 
     """
     # Check the list of Values
     if not checkIfVoid(values):
         print("Error")
-    if isinstance(values, dict):
-        xValues = np.asarray(values.keys())
-        yValues = np.asarray(values.values())
-    elif isinstance(values, np.ndarray):
-        xValues = np.unique(values[:, 0])
-        yValues = []
-        for xVal in xValues:
-            index = values[:,0] == xVal
-            yValues.append(values[index, 1])
-        yValues = scipy.array(yValues)
-    else:
-        print("Values shape not recognized")
+    xValues, yValues = getXYValues(values)
+    if xValues is None:
         return
     if not first_point:
         first_point = scipy.amin(xValues)*0.99
@@ -102,23 +211,24 @@ def averageLogDistribution(values, log_step=0.2, first_point=None, last_point=No
         last_point = scipy.amax(xValues)*1.01
 
     xbins, bins = getLogBins(first_point, last_point, log_step)
-    yAverage = []
-    for i, j in zip(bins[:-1],bins[1:]):
-        q1, q2 = np.greater_equal(xValues, i), np.less(xValues, j)
-        q = np.logical_and(q1, q2)
-        if sum(q) == 0:
-            averageValue = np.NaN
-        else:
-            allElements = [val for val in itertools.chain(*yValues[q])]
-            averageValue = sum(allElements)/float(len(allElements))
-            #print averageValue, allElements
-        yAverage.append(averageValue)
-    yAverage =  np.asanyarray(yAverage)
-    # Check if there are NaN values
-    iNan = np.isnan(yAverage)
-    x = xbins[~iNan]
-    y = yAverage[~iNan]
-    return x, y
+    n_bins = len(bins) - 1
+    # Bin of each value, i.e. bins[i] <= x < bins[i+1]
+    index = np.digitize(xValues, bins) - 1
+    isIn = (index >= 0) & (index < n_bins)
+    index, yValues = index[isIn], np.asarray(yValues[isIn], dtype=np.float64)
+    counts = np.bincount(index, minlength=n_bins)
+    sums = np.bincount(index, weights=yValues, minlength=n_bins)
+    isValue = counts > 0
+    yAverage = sums[isValue] / counts[isValue]
+    results = [xbins[isValue], yAverage]
+    if returnStd:
+        means = np.zeros(n_bins)
+        means[isValue] = yAverage
+        squares = np.bincount(index, weights=(yValues - means[index])**2, minlength=n_bins)
+        results.append(np.sqrt(squares[isValue] / counts[isValue]))
+    if returnCounts:
+        results.append(counts[isValue])
+    return tuple(results)
      
 if __name__ == "__main__":
     #listValues = scipy.rand(100)*230
@@ -0,0 +1,483 @@
+"""
+Vectorized calculation of the switch times and of the gray level steps
+for all the pixels of a stack of images, a 3D array of shape
+(dimX, dimY, n_images) (timeAxis=-1) or (n_images, dimX, dimY) (timeAxis=0).
+
+The results are the same of StackImages.getSwitchTime
+called pixel by pixel.
+The rows of the images can be split in tiles
+and processed by a pool of processes, which inherit the stack
+with fork (or read it from shared memory where fork is not available).
+The switches can also be found with the backends of cpuSwitchtime
+(as the GPU calculation of gpuSwitchtime)
+"""
+import ctypes
+import multiprocessing as mp
+import os
+import numpy as np
+import scipy.ndimage as nd
+import time
+import cpuSwitchtime as cst
+
+# Maximum size (in bytes) of the cumulative sums calculated at once
+MAX_CHUNK_BYTES = 2**28
+# Number of tiles for each process of the pool
+TILES_PER_WORKER = 4
+
+# The stack analysed by the processes of the pool
+_sharedStack = None
+
+def _getTile(stack, x0, x1, timeAxis):
+    """
+    Return the rows between x0 and x1 of the stack
+    """
+    if timeAxis == 0:
+        return stack[:, x0:x1]
+    else:
+        return stack[x0:x1]
+
+def _getConvolutionType(dtype):
+    """
+    Type of the convolution: the same of the stack,
+    but signed for unsigned stacks (as 16-bit images)
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'u':
+        return np.promote_types(dtype, np.int16)
+    return dtype
+
+def _getMinConvolution(stack, kernel, timeAxis=-1):
+    """
+    Convolve the kernel along the time axis of the stack
+    and return the min of the convolution and the switch position
+    """
+    convolution = nd.convolve1d(stack, kernel, axis=timeAxis, output=_getConvolutionType(stack.dtype))
+    return convolution.min(axis=timeAxis), convolution.argmin(axis=timeAxis) + 1
+
+def _getSwitchBackend(stack, kernel, backend, timeAxis=-1):
+    """
+    Find the switch positions with the cpuSwitchtime backend,
+    on the stack as (time, dimX, dimY)
+    """
+    if timeAxis != 0:
+        stack = np.transpose(stack, (2, 0, 1))
+    switch, t = cst.switchtime(stack, kernel, backend)
+    return switch + 1
+
+def _getMeanLevels(leftSum, leftCount, rightSum, rightCount):
+    """
+    Levels int(mean + 0.5) of the windows before and after the switch.
+    The window before the switch is empty with the 'zero' kernel
+    when the switch is at the first image: the empty window takes the level
+    of the other window, so the step is 0 and the pixel is not switched
+    """
+    leftLevels, rightLevels = [(np.true_divide(s, np.maximum(c, 1)) + 0.5).astype(np.int64) \
+                               for s, c in [(leftSum, leftCount), (rightSum, rightCount)]]
+    leftLevels = np.where(leftCount > 0, leftLevels, rightLevels)
+    rightLevels = np.where(rightCount > 0, rightLevels, leftLevels)
+    return leftLevels, rightLevels
+
+def _getLevels(stack, switch, isZero, halfWidth, width, timeAxis=-1):
+    """
+    Calculate the gray levels before and after the switch
+    of each pixel using the cumulative sums along the time axis.
+    The levels are rounded as int(mean + 0.5), as in StackImages._getLevels
+    (see _getMeanLevels for the empty windows)
+
+    Parameters:
+    ---------------
+    stack : ndarray
+        The 3D array of the gray levels
+    switch : ndarray
+        The 2D array of the switch positions
+    isZero : ndarray, bool
+        The 2D array of the pixels where the 'zero' kernel is used
+    halfWidth : int
+        Half length of the step kernel, used with width = 'small'
+    width : 'small' or 'all'
+        The points used to calculate the levels
+    timeAxis : int
+        The axis of the time, -1 or 0
+
+    Returns:
+    -----------
+    leftLevels, rightLevels : ndarray
+        The flattened arrays of the left and right levels
+    """
+    n_images = stack.shape[timeAxis]
+    if timeAxis == 0:
+        cumSeq = np.zeros((n_images + 1,) + switch.shape, dtype=np.int64)
+        np.cumsum(stack, axis=0, dtype=np.int64, out=cumSeq[1:])
+        cumSeq = cumSeq.reshape(n_images + 1, -1).T
+    else:
+        cumSeq = np.zeros(switch.shape + (n_images + 1,), dtype=np.int64)
+        np.cumsum(stack, axis=-1, dtype=np.int64, out=cumSeq[..., 1:])
+        cumSeq = cumSeq.reshape(-1, n_images + 1)
+    switch = switch.flatten()
+    shift = isZero.flatten() * 1
+    if width == 'small':
+        lowPoint = np.maximum(switch - halfWidth - shift, 0)
+        highPoint = np.minimum(switch + halfWidth, n_images)
+    elif width == 'all':
+        lowPoint = np.zeros_like(switch)
+        highPoint = np.zeros_like(switch) + n_images
+    else:
+        raise ValueError("Width %s not implemented yet" % width)
+    pixels = np.arange(len(switch))
+    sums = []
+    for i0, i1 in [(lowPoint, switch - shift), (switch, highPoint)]:
+        sums += [cumSeq[pixels, i1] - cumSeq[pixels, i0], i1 - i0]
+    return _getMeanLevels(*sums)
+
+def getSwitchTimesAndSteps(stack, kernel, kernel0, useKernel='step', width='all', \
+                           maxChunkBytes=None, n_workers=1, backend=None, timeAxis=-1):
+    """
+    getSwitchTimesAndSteps(stack, kernel, kernel0, useKernel='step', width='all', n_workers=1, backend=None, timeAxis=-1)
+
+    Return the positions of the switches in the sequences of all the pixels
+    and the gray level changes at the switches.
+    The stack is processed in tiles of rows,
+    and each tile is convolved at once along the time axis
+
+    Parameters:
+    ---------------
+    stack : ndarray
+        3D array of the images, with the time along timeAxis
+    kernel, kernel0 : ndarray
+        The 'step' and 'zero' kernels
+    useKernel : string
+        step = uses kernel
+        zero = uses kernel0
+        both = step & zero, the one with the lowest convolution is chosen
+    width : 'small' or 'all'
+        The points used to calculate the gray levels around the switch
+    maxChunkBytes : int, opt
+        Maximum memory used for the cumulative sums of a tile of rows
+    n_workers : int, opt
+        Number of processes used to analyse the tiles.
+        None uses all the CPU cores, 1 (default) does not start any process
+    backend : string, opt
+        None (default) uses scipy.ndimage.convolve1d;
+        'numpy', 'numba' or 'cuda' use cpuSwitchtime.switchtime,
+        which follows the conventions of the GPU kernels
+        (the 'both' kernel is not available)
+    timeAxis : int, opt
+        -1 (default) for a stack (dimX, dimY, n_images),
+        0 for a stack (n_images, dimX, dimY)
+
+    Returns:
+    -----------
+    switches : ndarray
+        Flattened array of the positions (not the image numbers)
+        of the switches
+    steps : ndarray
+        Flattened array of the gray level changes at the switches
+    """
+    if useKernel not in ['step', 'zero', 'both']:
+        raise ValueError("Kernel %s not available" % useKernel)
+    if not maxChunkBytes:
+        maxChunkBytes = MAX_CHUNK_BYTES
+    if backend is not None and useKernel == 'both':
+        raise ValueError("Kernel 'both' not available with backend %s" % backend)
+    if n_workers is None:
+        n_workers = mp.cpu_count()
+    if backend == 'cuda' and n_workers > 1:
+        raise ValueError("The cuda backend cannot run in a pool of processes")
+    if timeAxis == 0:
+        n_images, dimX, dimY = stack.shape
+    else:
+        dimX, dimY, n_images = stack.shape
+    halfWidth = len(kernel) // 2
+    rowsPerTile = max(1, maxChunkBytes // (8 * dimY * (n_images + 1)))
+    if n_workers > 1:
+        rowsPerTile = min(rowsPerTile, -(-dimX // (n_workers * TILES_PER_WORKER)))
+    tiles = [(x0, min(x0 + rowsPerTile, dimX)) for x0 in range(0, dimX, rowsPerTile)]
+    switches = np.zeros(dimX * dimY, dtype=np.int64)
+    steps = np.zeros(dimX * dimY, dtype=np.int64)
+    startTime = time.time()
+    if n_workers > 1:
+        results = _getTilesInPool(stack, tiles, kernel, kernel0, useKernel, width, halfWidth, \
+                                  backend, timeAxis, n_workers)
+    else:
+        results = (getSwitchTimesAndStepsChunk(_getTile(stack, x0, x1, timeAxis), kernel, kernel0, \
+                                               useKernel, width, halfWidth, backend, timeAxis) \
+                   for x0, x1 in tiles)
+    # Stitch the tiles in the flat order of the pixels
+    for (x0, x1), (switch, step) in zip(tiles, results):
+        switches[x0*dimY:x1*dimY] = switch
+        steps[x0*dimY:x1*dimY] = step
+    print "Switch times calculated in %.3f s" % (time.time() - startTime)
+    return switches, steps
+
+def _initWorker(sharedBuffer, dtype, shape):
+    """
+    Set the stack of a process of the pool as a view of the shared memory
+    """
+    global _sharedStack
+    _sharedStack = np.frombuffer(sharedBuffer, dtype=dtype).reshape(shape)
+
+def _getSwitchTimesAndStepsTile(args):
+    x0, x1, kernel, kernel0, useKernel, width, halfWidth, backend, timeAxis = args
+    return getSwitchTimesAndStepsChunk(_getTile(_sharedStack, x0, x1, timeAxis), kernel, kernel0, \
+                                       useKernel, width, halfWidth, backend, timeAxis)
+
+def _getTilesInPool(stack, tiles, kernel, kernel0, useKernel, width, halfWidth, backend, timeAxis, \
+                    n_workers):
+    """
+    Analyse the tiles in a pool of n_workers processes.
+    The stack is not pickled for the processes: with fork they inherit it
+    as _sharedStack, without any copy; otherwise it is copied once
+    in shared memory. The results are returned in the order of the tiles
+    """
+    global _sharedStack
+    if hasattr(os, 'fork'):
+        _sharedStack = stack
+        initializer, initargs = None, ()
+    else:
+        sharedBuffer = mp.RawArray(ctypes.c_char, stack.nbytes)
+        sharedStack = np.frombuffer(sharedBuffer, dtype=stack.dtype).reshape(stack.shape)
+        sharedStack[:] = stack
+        del sharedStack
+        initializer, initargs = _initWorker, (sharedBuffer, stack.dtype, stack.shape)
+    try:
+        pool = mp.Pool(n_workers, initializer=initializer, initargs=initargs)
+        try:
+            args = [(x0, x1, kernel, kernel0, useKernel, width, halfWidth, backend, timeAxis) \
+                    for x0, x1 in tiles]
+            results = pool.map(_getSwitchTimesAndStepsTile, args)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        _sharedStack = None
+    return results
+
+def getSwitchTimesAndStepsChunk(stack, kernel, kernel0, useKernel, width, halfWidth, backend=None, \
+                                timeAxis=-1):
+    """
+    Calculate the switches and the steps of a chunk of rows of the stack
+    See getSwitchTimesAndSteps for the parameters
+    """
+    if useKernel == 'step' or useKernel == 'both':
+        if backend is None:
+            minStepKernel, switchStepKernel = _getMinConvolution(stack, kernel, timeAxis)
+        else:
+            switchStepKernel = _getSwitchBackend(stack, kernel, backend, timeAxis)
+        switch = switchStepKernel
+        isZero = np.zeros(switch.shape, dtype=bool)
+    if useKernel == 'zero' or useKernel == 'both':
+        if backend is None:
+            minZeroKernel, switchZeroKernel = _getMinConvolution(stack, kernel0, timeAxis)
+        else:
+            switchZeroKernel = _getSwitchBackend(stack, kernel0, backend, timeAxis)
+        switch = switchZeroKernel
+        isZero = np.ones(switch.shape, dtype=bool)
+    if useKernel == 'both':
+        isZero = minStepKernel > minZeroKernel
+        switch = np.where(isZero, switchZeroKernel, switchStepKernel)
+    leftLevels, rightLevels = _getLevels(stack, switch, isZero, halfWidth, width, timeAxis)
+    return switch.flatten(), np.abs(leftLevels - rightLevels)
+
+class SwitchTimesStream:
+    """
+    Streaming calculation of the switch times and steps,
+    for stacks which do not fit in memory.
+    The images are passed in order with addFrame, and only a window
+    of the last images (as long as the kernel) is kept in memory,
+    together with the running min of the convolution, its position
+    and the sums of the gray levels around it.
+    The results, given by finish, are the same of getSwitchTimesAndSteps
+
+    Parameters:
+    ---------------
+    kernel, kernel0, useKernel, width :
+        as in getSwitchTimesAndSteps
+    """
+    def __init__(self, kernel, kernel0, useKernel='step', width='all'):
+        if useKernel not in ['step', 'zero', 'both']:
+            raise ValueError("Kernel %s not available" % useKernel)
+        if width not in ['small', 'all']:
+            raise ValueError("Width %s not implemented yet" % width)
+        self.useKernel = useKernel
+        self.width = width
+        self.halfWidth = len(kernel) // 2
+        self.n_images = 0
+        self._kernels = {}
+        if useKernel in ['step', 'both']:
+            self._kernels['step'] = _KernelStream(kernel, isZero=False)
+        if useKernel in ['zero', 'both']:
+            self._kernels['zero'] = _KernelStream(kernel0, isZero=True)
+        self._windowLength = max([len(k.weights) for k in self._kernels.values()]) + 1
+        self._window = [None] * self._windowLength
+        self._total = None
+
+    def _getFrame(self, index, n_images=None):
+        """
+        Return the frame at index of the sequence,
+        reflected at the boundaries as in scipy.ndimage.convolve1d
+        """
+        if index < 0:
+            index = -1 - index
+        if n_images is not None and index >= n_images:
+            index = 2 * n_images - 1 - index
+        return self._window[index % self._windowLength]
+
+    def addFrame(self, frame):
+        """
+        Add the next image of the sequence
+        and update the switches which can be calculated
+        """
+        frame = np.asarray(frame)
+        if self._total is None:
+            self._dtype = _getConvolutionType(frame.dtype)
+            self._total = np.zeros(frame.shape, dtype=np.int64)
+            for k in self._kernels.values():
+                k.initialize(frame.shape, self._dtype)
+        self._window[self.n_images % self._windowLength] = frame
+        self._total += frame
+        self.n_images += 1
+        for k in self._kernels.values():
+            while k.nextIndex + k.lookAhead < self.n_images:
+                self._updateKernel(k)
+
+    def _updateKernel(self, k, n_images=None):
+        """
+        Calculate the convolution at the next position of the kernel k
+        and update the switches where it is below the running min
+        """
+        i = k.nextIndex
+        convolution = np.zeros(self._total.shape, dtype=np.float64)
+        for j, w in enumerate(k.weights):
+            if w:
+                convolution += w * self._getFrame(i + j - k.center, n_images)
+        convolution = convolution.astype(self._dtype)
+        frame = self._getFrame(i)
+        if i == 0:
+            isUpdated = np.ones(convolution.shape, dtype=bool)
+        else:
+            isUpdated = convolution < k.minConvolution
+        if isUpdated.any():
+            switch = i + 1
+            k.minConvolution[isUpdated] = convolution[isUpdated]
+            k.switch[isUpdated] = switch
+            if self.width == 'all':
+                # Sums of the levels up to the switch, i.e. of the images before i (+ i)
+                left = k.prefix + (not k.isZero) * frame
+                k.leftSum[isUpdated] = left[isUpdated]
+                k.leftCount[isUpdated] = switch - k.isZero
+                k.rightSum[isUpdated] = -(k.prefix + frame)[isUpdated]
+            else:
+                lowPoint = max(switch - self.halfWidth - k.isZero, 0)
+                if n_images is None:
+                    highPoint = switch + self.halfWidth
+                else:
+                    highPoint = min(switch + self.halfWidth, n_images)
+                for sums, counts, i0, i1 in [(k.leftSum, k.leftCount, lowPoint, switch - k.isZero), \
+                                             (k.rightSum, k.rightCount, switch, highPoint)]:
+                    s = np.zeros(convolution.shape, dtype=np.int64)
+                    for index in range(i0, i1):
+                        s += self._getFrame(index)
+                    sums[isUpdated] = s[isUpdated]
+                    counts[isUpdated] = i1 - i0
+        k.prefix += frame
+        k.nextIndex += 1
+
+    def finish(self):
+        """
+        Complete the calculation at the end of the sequence
+
+        Returns:
+        -----------
+        switches, steps : ndarray
+            as in getSwitchTimesAndSteps
+        """
+        n_images = self.n_images
+        for k in self._kernels.values():
+            while k.nextIndex < n_images:
+                self._updateKernel(k, n_images)
+            if self.width == 'all':
+                k.rightSum += self._total
+                k.rightCount = n_images - k.switch
+        levels = {}
+        for name, k in self._kernels.items():
+            levels[name] = self._getKernelLevels(k)
+        if self.useKernel == 'both':
+            step, zero = self._kernels['step'], self._kernels['zero']
+            isZero = step.minConvolution > zero.minConvolution
+            switch = np.where(isZero, zero.switch, step.switch)
+            leftLevels, rightLevels = [np.where(isZero, lz, ls) for ls, lz in zip(levels['step'], levels['zero'])]
+        else:
+            switch = self._kernels[self.useKernel].switch
+            leftLevels, rightLevels = levels[self.useKernel]
+        return switch.flatten(), np.abs(leftLevels - rightLevels).flatten()
+
+    def _getKernelLevels(self, k):
+        """
+        Gray levels before and after the current switches of the kernel k
+        """
+        return _getMeanLevels(k.leftSum, k.leftCount, k.rightSum, k.rightCount)
+
+    def getPartial(self):
+        """
+        Switches and steps of the images added so far,
+        before the end of the sequence.
+        Available for a single kernel and width='small',
+        where the levels around the switch do not depend on the next images
+
+        Returns:
+        -----------
+        switches, steps : ndarray
+            as in getSwitchTimesAndSteps, with the positions
+            of the running min of the convolution
+            (empty before the first position of the kernel)
+        n_positions : int
+            Number of positions of the kernel calculated so far:
+            a switch at position p has been the min for n_positions - p positions
+        """
+        if self.useKernel == 'both' or self.width != 'small':
+            raise ValueError("Partial results need a single kernel and width='small'")
+        k = self._kernels[self.useKernel]
+        if self._total is None or not k.nextIndex:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), 0
+        leftLevels, rightLevels = self._getKernelLevels(k)
+        return k.switch.flatten(), np.abs(leftLevels - rightLevels).flatten(), k.nextIndex
+
+class _KernelStream:
+    """
+    State of the streaming convolution of one kernel
+    """
+    def __init__(self, kernel, isZero):
+        # Weights and center as in scipy.ndimage.convolve1d
+        self.weights = np.asarray(kernel)[::-1]
+        size = len(kernel)
+        self.center = size // 2 - (size % 2 == 0)
+        self.lookAhead = size - 1 - self.center
+        self.isZero = int(isZero)
+        self.nextIndex = 0
+
+    def initialize(self, shape, dtype):
+        self.minConvolution = np.zeros(shape, dtype=dtype)
+        self.switch = np.zeros(shape, dtype=np.int64)
+        self.prefix = np.zeros(shape, dtype=np.int64)
+        self.leftSum = np.zeros(shape, dtype=np.int64)
+        self.rightSum = np.zeros(shape, dtype=np.int64)
+        self.leftCount = np.zeros(shape, dtype=np.int64)
+        self.rightCount = np.zeros(shape, dtype=np.int64)
+
+if __name__ == "__main__":
+    # Regression check: with the 'zero' kernel, a switch at the first image
+    # has an empty window before it, and the step must be 0
+    kernel = np.array([-1]*5 + [1]*5)
+    kernel0 = np.array([-1]*5 + [0] + [1]*5)
+    stack = np.zeros((2, 3, 20), dtype=np.int16) + 100
+    stack[1, :, :8] = 20
+    for width in ['small', 'all']:
+        for useKernel in ['zero', 'both']:
+            switches, steps = getSwitchTimesAndSteps(stack, kernel, kernel0, useKernel, width)
+            stream = SwitchTimesStream(kernel, kernel0, useKernel, width)
+            for i in range(stack.shape[2]):
+                stream.addFrame(stack[:,:,i])
+            streamSwitches, streamSteps = stream.finish()
+            assert (switches == streamSwitches).all() and (steps == streamSteps).all()
+            assert (steps[:3] == 0).all() and (steps[3:] > 0).all(), (width, useKernel, steps)
+    print "ok"
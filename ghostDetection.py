@@ -0,0 +1,104 @@
+"""
+Detection of 'ghost' avalanches, i.e. avalanches split between two frames
+
+The clusters of all the frames are labeled in a single pass
+(labelAvalanches.labelSwitchMap). The clusters of a frame t
+touching the clusters of the frame t+1 are the edges of a graph between
+the clusters of consecutive frames, so the number of clusters
+of the union of the frames t and t+1 is the number of connected components
+of the graph restricted to the two frames: all the pairs of frames
+are calculated at once, with a single call of connected_components
+on a graph with two nodes per cluster (one for the pair with the previous
+frame, one for the pair with the next frame).
+Memory is O(pixels), for any number of frames
+"""
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+import labelAvalanches as lA
+
+def _getNextFrameEdges(switchMap, labels, NN=8):
+    """
+    Pairs of clusters (a, b) touching each other, where b switches
+    at the switch time of a plus 1
+    """
+    dimX, dimY = switchMap.shape
+    shifts = [(0, 1), (1, 0)]
+    if NN == 8:
+        shifts += [(1, 1), (1, -1)]
+    lower, upper = [], []
+    for dx, dy in shifts:
+        (x0, x1), (y0, y1) = lA._getShiftSlices(dx, dimX), lA._getShiftSlices(dy, dimY)
+        labels0, labels1 = labels[x0, y0], labels[x1, y1]
+        times0, times1 = switchMap[x0, y0], switchMap[x1, y1]
+        isIn = (labels0 >= 0) & (labels1 >= 0)
+        for isNext, first, second in [(times1 == times0 + 1, labels0, labels1), \
+                                      (times0 == times1 + 1, labels1, labels0)]:
+            isNext &= isIn
+            lower.append(first[isNext])
+            upper.append(second[isNext])
+    return np.concatenate(lower), np.concatenate(upper)
+
+def getGhostStatistics(switchMap, mask=None, NN=8):
+    """
+    getGhostStatistics(switchMap, mask=None, NN=8)
+
+    Number of clusters of each frame and of its union with the next frame
+
+    Parameters:
+    ---------------
+    switchMap : ndarray
+        2D array of the switch times (image numbers)
+    mask : ndarray, opt
+        2D array of bool of the switched pixels
+    NN : int
+        No of Nearest Neighbours (4 or 8)
+
+    Returns:
+    -----------
+    times : ndarray
+        The switch times with switched pixels
+    n_clusters : ndarray
+        The number of clusters of each switch time t
+    n_joint : ndarray
+        The number of clusters of the union of the frames t and t+1
+    """
+    switchMap = np.asarray(switchMap)
+    labels, clusterTimes = lA.labelSwitchMap(switchMap, NN, mask)
+    n_labels = len(clusterTimes)
+    if not n_labels:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    times, clusterFrames = np.unique(clusterTimes, return_inverse=True)
+    n_clusters = np.bincount(clusterFrames, minlength=len(times))
+    lower, upper = _getNextFrameEdges(switchMap, labels, NN)
+    # Node 2*c: cluster c in the pair with the next frame; node 2*c+1: with the previous frame
+    graph = sparse.coo_matrix((np.ones(len(lower), dtype=np.int8), (2 * lower, 2 * upper + 1)), \
+                              shape=(2 * n_labels, 2 * n_labels))
+    n_components, components = connected_components(graph, directed=False)
+    # The pair of each node, indexed by the position of its first frame in times
+    previous = np.searchsorted(times, clusterTimes - 1)
+    hasPrevious = times[np.minimum(previous, len(times) - 1)] == clusterTimes - 1
+    nodes = np.concatenate((2 * np.arange(n_labels), 2 * np.flatnonzero(hasPrevious) + 1))
+    pairs = np.concatenate((clusterFrames, previous[hasPrevious]))
+    uniqueComponents, first = np.unique(components[nodes], return_index=True)
+    n_joint = np.bincount(pairs[first], minlength=len(times))
+    return times, n_clusters, n_joint
+
+def findGhosts(times, n_clusters, n_joint, clusterThreshold=15):
+    """
+    findGhosts(times, n_clusters, n_joint, clusterThreshold=15)
+
+    Consecutive frames t, t+1 with at least clusterThreshold clusters each
+    (i.e. spongy avalanches), as returned by getGhostStatistics
+
+    Returns:
+    -----------
+    ghosts : ndarray
+        The first frame t of each pair
+    n_joint : ndarray
+        The number of clusters of the union of each pair
+    """
+    isGhost = n_clusters >= clusterThreshold
+    ghostTimes, ghostJoint = times[isGhost], n_joint[isGhost]
+    isPair = ghostTimes[1:] == ghostTimes[:-1] + 1
+    return ghostTimes[:-1][isPair], ghostJoint[:-1][isPair]
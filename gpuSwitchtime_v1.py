@@ -12,9 +12,10 @@ def gpuSwitchtime(StackImages,dim_x,dim_y,dim_z,usekernel,device=None):
 	---------------
 	StackImages: int32 : 3D Array of images
 
-	useKernel : string
+	useKernel : string or sequence
 		step = [1]*5 +[-1]*5
 		zero = [1]*5 +[0] + [-1]*5
+		or the sequence of the kernel values
 
 	dim_x= x-dimensions of images
 	dim_y= y-dimensions of images
@@ -51,6 +52,14 @@ def gpuSwitchtime(StackImages,dim_x,dim_y,dim_z,usekernel,device=None):
 			origin=-1
 		else:
 			origin=0
+	if not isinstance(usekernel,str):
+		kernel=list(usekernel)
+		kernel2=kernel[::-1]
+		kernel2=numpy.array(kernel2,dtype=numpy.int32)
+		if (len(kernel)%2==0):
+			origin=-1
+		else:
+			origin=0
 
 	#Mirror of first and last elements
 	stepsize=len(kernel)
@@ -0,0 +1,80 @@
+"""
+Stack of images which can grow during the acquisition
+
+The images are stored in a preallocated buffer with a capacity
+larger than the number of images; when the buffer is full,
+a new one with double capacity is allocated and the images are copied once,
+so adding images has a constant amortized cost.
+The stack is given as a view of the images in the buffer,
+with the layouts of StackImages.Array ('pixel' or 'frame')
+"""
+import numpy as np
+
+class GrowableStack:
+    """
+    Preallocated stack of images
+
+    Parameters:
+    ---------------
+    frameShape : tuple
+        The shape (dimX, dimY) of the images
+    dtype : dtype
+        The dtype of the images
+    layout : string
+        'pixel': the stack is (dimX, dimY, n_images)
+        'frame': the stack is (n_images, dimX, dimY)
+    capacity : int
+        The initial number of images of the buffer
+    """
+    def __init__(self, frameShape, dtype, layout='pixel', capacity=16):
+        if layout not in ['pixel', 'frame']:
+            raise ValueError("Layout %s not available" % layout)
+        self.frameShape = tuple(frameShape)
+        self.dtype = dtype
+        self.layout = layout
+        self.n_images = 0
+        self._buffer = self._allocate(max(capacity, 1))
+
+    def _allocate(self, capacity):
+        if self.layout == 'frame':
+            shape = (capacity,) + self.frameShape
+        else:
+            shape = self.frameShape + (capacity,)
+        return np.empty(shape, dtype=self.dtype)
+
+    def getCapacity(self):
+        if self.layout == 'frame':
+            return self._buffer.shape[0]
+        return self._buffer.shape[-1]
+
+    def extend(self, n_images):
+        """
+        Add n_images at the end of the stack (to be set with setFrame),
+        enlarging the buffer if needed.
+        Returns the stack
+        """
+        n_total = self.n_images + n_images
+        capacity = self.getCapacity()
+        if n_total > capacity:
+            buf = self._allocate(max(n_total, 2 * capacity))
+            if self.layout == 'frame':
+                buf[:self.n_images] = self._buffer[:self.n_images]
+            else:
+                buf[:,:,:self.n_images] = self._buffer[:,:,:self.n_images]
+            self._buffer = buf
+        self.n_images = n_total
+        return self.getArray()
+
+    def setFrame(self, index, image):
+        if self.layout == 'frame':
+            self._buffer[index] = image
+        else:
+            self._buffer[:,:,index] = image
+
+    def getArray(self):
+        """
+        Return the stack of the images as a view of the buffer
+        """
+        if self.layout == 'frame':
+            return self._buffer[:self.n_images]
+        return self._buffer[:,:,:self.n_images]
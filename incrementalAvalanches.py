@@ -0,0 +1,216 @@
+"""
+Avalanche statistics updated while the images are being acquired
+
+The new images written in mainDir are read in order and added to
+a streaming calculation of the switches (getSwitchTimes.SwitchTimesStream).
+A pixel is finalized when its switch has been the min of the convolution
+for confirmFrames positions of the kernel (i.e. it is past the kernel window)
+and its gray level change is above the threshold: its switch time
+is not changed anymore. All the pixels of an image are finalized
+at the same update, so the avalanches and clusters of the new finalized
+pixels are labeled (with labelAvalanches) and added to the distributions,
+and the cost of an update depends only on the new images.
+
+The levels are calculated around the switch (width='small').
+Differently from StackImages.getSwitchTimesAndSteps, a pixel finalized
+is not changed by a larger step occurring later in the sequence.
+"""
+import numpy as np
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+import readTiff
+import getSwitchTimes as gst
+import labelAvalanches as lA
+import getLogDistributions as gLD
+import watchDir
+
+def readImage(fileName):
+    """
+    Read an image as int16 (16-bit images as uint16), as in StackImages
+    """
+    im = Image.open(fileName)
+    if readTiff.isTiff16(im):
+        return readTiff.imread16(fileName)
+    return np.asarray(im).astype(np.int16)
+
+def _addToHistogram(histogram, sizes):
+    """
+    Add the sizes to the histogram (the no. of avalanches/clusters of each size),
+    enlarging it if needed
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if not len(sizes):
+        return histogram
+    maxSize = sizes.max()
+    if maxSize >= len(histogram):
+        newHistogram = np.zeros(max(maxSize + 1, 2 * len(histogram)), dtype=np.int64)
+        newHistogram[:len(histogram)] = histogram
+        histogram = newHistogram
+    np.add.at(histogram, sizes, 1)
+    return histogram
+
+def logDistributionFromHistogram(histogram, log_step=0.2, first_point=1., normed=True):
+    """
+    Distribution in log scale (as gLD.logDistribution)
+    of the values counted in histogram
+    """
+    values = np.flatnonzero(histogram)
+    if not len(values):
+        return np.array([]), np.array([])
+    return gLD.logDistribution(values, log_step, first_point, normed=normed, weights=histogram[values])
+
+class IncrementalAvalanches:
+    """
+    Distributions of avalanches and clusters updated during the acquisition
+
+    Parameters:
+    ---------------
+    mainDir, pattern : string
+        as in StackImages
+    threshold : int
+        Minimum gray level change at the switch to consider
+        a pixel as switched. Use a value above the noise: the pixels
+        are finalized as soon as the switch is confirmed
+    kernel : ndarray, opt
+        The step kernel, as in StackImages (black to white change by default;
+        use -kernel for a white to black change)
+    useKernel : string
+        'step' or 'zero'
+    imageDir : string
+        The direction of the avalanche motion, as in getAxyLabels
+    NN, edgeThickness : int
+        as in StackImages.getDistributions
+    filterImage : function, opt
+        Filter applied to each image after reading, as filterImage(image)
+    confirmFrames : int, opt
+        Number of positions of the kernel after the switch
+        to finalize a pixel. Default is the length of the kernel
+    firstImage : int, opt
+        Number of the first image to analyse
+
+    Usage:
+    ---------
+    inc = IncrementalAvalanches(mainDir, "Data1-*.tif", threshold=30)
+    while acquiring:
+        inc.update()
+        D_x, D_y = logDistributionFromHistogram(inc.avalancheHistogram)
+    inc.finish()
+    """
+    def __init__(self, mainDir, pattern, threshold, kernel=None, useKernel='step', \
+                 imageDir="Left_to_right", NN=8, edgeThickness=1, filterImage=None, \
+                 confirmFrames=None, firstImage=None):
+        if useKernel not in ['step', 'zero']:
+            raise ValueError("Kernel %s not available" % useKernel)
+        if kernel is None:
+            kernel = np.array([-1]*(5) + [1]*(5))
+        kernel = np.asarray(kernel)
+        halfWidth = len(kernel) // 2
+        kernel0 = np.concatenate((kernel[:halfWidth], [0], kernel[halfWidth:]))
+        self.threshold = threshold
+        self.imageDir = imageDir
+        self.NN = NN
+        self.edgeThickness = edgeThickness
+        self._filterImage = filterImage
+        if confirmFrames is None:
+            confirmFrames = len(kernel)
+        self.confirmFrames = confirmFrames
+        self.watcher = watchDir.DirectoryWatcher(mainDir, pattern, firstImage)
+        self._stream = gst.SwitchTimesStream(kernel, kernel0, useKernel, 'small')
+        self.imageNumbers = []
+        self.shape = None
+        # Image number of the switch of the finalized pixels, -1 otherwise
+        self.switchTimes2D = None
+        self._isFinal = None
+        self.D_avalanches = []
+        self.D_cluster = []
+        self.N_cluster = []
+        self.avalancheTimes = []
+        self.dictAxy = {'aval': {}, 'clus': {}}
+        self.avalancheHistogram = np.zeros(1, dtype=np.int64)
+        self.clusterHistogram = np.zeros(1, dtype=np.int64)
+
+    def addFrame(self, frame, imageNumber):
+        """
+        Add the next image of the sequence
+        """
+        if self._filterImage:
+            frame = self._filterImage(frame)
+        if self.shape is None:
+            self.shape = frame.shape
+            self.switchTimes2D = -np.ones(self.shape, dtype=np.int64)
+            self._isFinal = np.zeros(frame.size, dtype=bool)
+        self._stream.addFrame(frame)
+        self.imageNumbers.append(imageNumber)
+
+    def update(self, includeLast=False):
+        """
+        Read the new images of mainDir and update the distributions
+
+        Parameters:
+        ---------------
+        includeLast : bool
+            Also read the image with the highest number
+            (which could be still being written)
+
+        Returns:
+        -----------
+        n_images : int
+            The number of new images
+        """
+        imageNumbers, fileNames = self.watcher.poll(includeLast)
+        for imageNumber, fileName in zip(imageNumbers, fileNames):
+            self.addFrame(readImage(fileName), imageNumber)
+        if self.shape is not None:
+            switches, steps, n_positions = self._stream.getPartial()
+            # No switch is available before the first position of the kernel
+            if n_positions:
+                isConfirmed = n_positions - switches >= self.confirmFrames
+                self._addSwitches(switches, steps, isConfirmed)
+        return len(imageNumbers)
+
+    def finish(self):
+        """
+        Read the last images at the end of the acquisition,
+        and finalize all the remaining switched pixels
+        """
+        self.update(includeLast=True)
+        if self.shape is None:
+            return
+        switches, steps = self._stream.finish()
+        # The switch is at index n_images when the min of the convolution
+        # is at the last image: the step is after the last image
+        # (with no levels after it), so the pixel is not switched
+        self._addSwitches(switches, steps, switches < len(self.imageNumbers))
+
+    def _addSwitches(self, switches, steps, isConfirmed):
+        """
+        Finalize the confirmed pixels above the threshold
+        and add their avalanches and clusters to the distributions
+        """
+        isNew = ~self._isFinal & isConfirmed & (steps >= self.threshold)
+        if not isNew.any():
+            return
+        self._isFinal |= isNew
+        isNew = isNew.reshape(self.shape)
+        self.switchTimes2D[isNew] = np.asarray(self.imageNumbers)[switches.reshape(self.shape)[isNew]]
+        avalanches, clusters = lA.getAvalanchesAndClusters(self.switchTimes2D, self.imageDir, self.NN, \
+                                                           self.edgeThickness, mask=isNew)
+        self.avalancheTimes.extend(avalanches['times'])
+        self.D_avalanches.extend(avalanches['sizes'])
+        self.N_cluster.extend(avalanches['n_clusters'])
+        self.D_cluster.extend(clusters['sizes'])
+        for kind, results in [('aval', avalanches), ('clus', clusters)]:
+            for Axy, size in zip(results['Axy'], results['sizes']):
+                self.dictAxy[kind].setdefault(Axy, []).append(size)
+        self.avalancheHistogram = _addToHistogram(self.avalancheHistogram, avalanches['sizes'])
+        self.clusterHistogram = _addToHistogram(self.clusterHistogram, clusters['sizes'])
+
+    def getDistributions(self, log_step=0.2):
+        """
+        Return the distributions in log scale of the clusters
+        and of the avalanches found so far, as (D_x, D_y), (P_x, P_y)
+        """
+        return logDistributionFromHistogram(self.clusterHistogram, log_step), \
+               logDistributionFromHistogram(self.avalancheHistogram, log_step)
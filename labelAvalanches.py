@@ -0,0 +1,136 @@
+"""
+Labeling of all the avalanches and clusters of a switch time map in one pass
+
+A cluster is a connected set of pixels with the same switch time:
+instead of labeling the image of each frame (with nd.label),
+the pixels are joined to their neighbours with the same switch time
+and the connected components of this graph are found once
+for the whole map (scipy.sparse.csgraph, a union-find over the pixels).
+Sizes, number of clusters and touched edges are then calculated
+with np.bincount, so the cost is O(pixels) and not O(frames x pixels).
+The clusters are numbered in the same order of the frame by frame analysis
+(by switch time, and in each frame as in nd.label)
+"""
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+import getAxyLabels as gal
+
+def _getShiftSlices(shift, size):
+    """
+    Slices of an axis selecting the pixels and their neighbours at distance shift
+    """
+    if shift >= 0:
+        return slice(0, size - shift), slice(shift, size)
+    return slice(-shift, size), slice(0, size + shift)
+
+def labelSwitchMap(switchMap, NN=8, mask=None):
+    """
+    labelSwitchMap(switchMap, NN=8, mask=None)
+
+    Label the connected clusters of pixels with equal switch time
+
+    Parameters:
+    ---------------
+    switchMap : ndarray
+        2D array of the switch times (as StackImages._switchTimes2D)
+    NN : int
+        No of Nearest Neighbours (4 or 8) to connect two pixels
+    mask : ndarray, opt
+        2D array of bool: only the pixels in the mask are labeled
+
+    Returns:
+    -----------
+    labels : ndarray
+        2D array with the cluster of each pixel (from 0 to n_labels-1,
+        -1 outside the mask), ordered by switch time and, for the same switch time,
+        by the first pixel (as in nd.label)
+    clusterTimes : ndarray
+        The switch time of each cluster
+    """
+    switchMap = np.asarray(switchMap)
+    dimX, dimY = switchMap.shape
+    index = np.arange(switchMap.size).reshape(dimX, dimY)
+    shifts = [(0, 1), (1, 0)]
+    if NN == 8:
+        shifts += [(1, 1), (1, -1)]
+    rows, cols = [], []
+    for dx, dy in shifts:
+        (x0, x1), (y0, y1) = _getShiftSlices(dx, dimX), _getShiftSlices(dy, dimY)
+        isEqual = switchMap[x0, y0] == switchMap[x1, y1]
+        if mask is not None:
+            isEqual &= mask[x0, y0] & mask[x1, y1]
+        rows.append(index[x0, y0][isEqual])
+        cols.append(index[x1, y1][isEqual])
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    graph = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                              shape=(switchMap.size, switchMap.size))
+    n_labels, labels = connected_components(graph, directed=False)
+    if mask is None:
+        pixels = np.arange(switchMap.size)
+    else:
+        pixels = np.flatnonzero(mask)
+    # Renumber the clusters by switch time and first pixel
+    components, firstPixels, labels = np.unique(labels[pixels], return_index=True, return_inverse=True)
+    firstPixels = pixels[firstPixels]
+    clusterTimes = switchMap.ravel()[firstPixels]
+    order = np.lexsort((firstPixels, clusterTimes))
+    rank = np.empty(len(components), dtype=np.int64)
+    rank[order] = np.arange(len(components))
+    clusterLabels = -np.ones(switchMap.size, dtype=np.int64)
+    clusterLabels[pixels] = rank[labels]
+    return clusterLabels.reshape(dimX, dimY), clusterTimes[order]
+
+def _countLabels(labels, n_labels):
+    """
+    No. of pixels of each label, skipping the pixels outside the mask (-1)
+    """
+    labels = labels.ravel()
+    return np.bincount(labels[labels >= 0], minlength=n_labels)
+
+def getAvalanchesAndClusters(switchMap, imageDir, NN=8, edgeThickness=1, fraction=None, mask=None):
+    """
+    getAvalanchesAndClusters(switchMap, imageDir, NN=8, edgeThickness=1, fraction=None, mask=None)
+
+    Sizes, number of clusters and touched edges of all the avalanches
+    (i.e. all the pixels with the same switch time) and of their clusters
+
+    Parameters:
+    ---------------
+    switchMap : ndarray
+        2D array of the switch times (as StackImages._switchTimes2D)
+    imageDir : string
+        The direction of the avalanche motion, as in getAxyLabels
+    NN : int
+        No of Nearest Neighbours (4 or 8)
+    edgeThickness : int
+        No of pixels for each edge to consider as the frame of the image
+    fraction : float
+        as in getAxyLabels
+    mask : ndarray, opt
+        2D array of bool: only the pixels in the mask are analysed
+
+    Returns:
+    -----------
+    avalanches : dict
+        'times', 'sizes', 'n_clusters' and 'Axy' of each avalanche
+    clusters : dict
+        'times', 'sizes' and 'Axy' of each cluster, in the order
+        of the frame by frame analysis
+    """
+    labels, clusterTimes = labelSwitchMap(switchMap, NN, mask)
+    n_labels = len(clusterTimes)
+    times, clusterFrames = np.unique(clusterTimes, return_inverse=True)
+    n_frames = len(times)
+    clusterSizes = _countLabels(labels, n_labels)
+    clusterEdgeCounts = [_countLabels(edge, n_labels)
+                         for edge in gal.getEdges(labels, imageDir, edgeThickness)]
+    avalancheSizes = np.bincount(clusterFrames, weights=clusterSizes, minlength=n_frames).astype(np.int64)
+    avalancheEdgeCounts = [np.bincount(clusterFrames, weights=counts, minlength=n_frames)
+                           for counts in clusterEdgeCounts]
+    avalanches = {'times': times, 'sizes': avalancheSizes,
+                  'n_clusters': np.bincount(clusterFrames, minlength=n_frames),
+                  'Axy': gal.axyToString(gal.getAxyBitmask(avalancheEdgeCounts, avalancheSizes, fraction))}
+    clusters = {'times': clusterTimes, 'sizes': clusterSizes,
+                'Axy': gal.axyToString(gal.getAxyBitmask(clusterEdgeCounts, clusterSizes, fraction))}
+    return avalanches, clusters
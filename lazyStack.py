@@ -0,0 +1,73 @@
+"""
+Lazy stack of images, decoded only when requested
+
+The stack is a proxy of the list of image files: a frame is decoded
+(and filtered) the first time it is requested, and kept in a cache
+of the last used frames (LRU) within a memory budget.
+StackImages loads the whole stack only for the operations
+which need all the frames (as the calculation of the switches)
+"""
+import threading
+from collections import OrderedDict
+
+# Default memory budget of the cache of the frames
+MAX_CACHE_BYTES = 2**28
+
+class LazyStack:
+    """
+    Frames of a sequence of images decoded on demand
+
+    Parameters:
+    ---------------
+    readImage : function
+        readImage(index) returns the (filtered) image at index of the sequence
+    n_images : int
+        The number of images of the sequence
+    maxBytes : int, opt
+        The memory budget of the cache of the decoded frames
+    """
+    def __init__(self, readImage, n_images, maxBytes=MAX_CACHE_BYTES):
+        self._readImage = readImage
+        self.n_images = n_images
+        self.maxBytes = maxBytes
+        self._cache = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+
+    def __len__(self):
+        return self.n_images
+
+    def getFrame(self, index):
+        """
+        Return the frame at index (negative indexes count from the end),
+        as a read-only array
+        """
+        if index < 0:
+            index += self.n_images
+        if index < 0 or index >= self.n_images:
+            raise IndexError("Index %i out of the stack of %i images" % (index, self.n_images))
+        with self._lock:
+            if index in self._cache:
+                # Move the frame to the end, i.e. the most recently used
+                frame = self._cache.pop(index)
+                self._cache[index] = frame
+                self.hits += 1
+                return frame
+        frame = self._readImage(index)
+        frame.setflags(write=False)
+        with self._lock:
+            self.misses += 1
+            if index not in self._cache:
+                self._cache[index] = frame
+                self._nbytes += frame.nbytes
+                # Remove the least recently used frames (keeping the last one)
+                while self._nbytes > self.maxBytes and len(self._cache) > 1:
+                    oldIndex, oldFrame = self._cache.popitem(last=False)
+                    self._nbytes -= oldFrame.nbytes
+        return frame
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._nbytes = 0
@@ -0,0 +1,111 @@
+"""
+Pipeline to load a sequence of images with threads
+
+The images are decoded by a set of threads and put in a queue
+of limited size (the prefetch), from which another set of threads
+takes, filters and stores them (for instance directly in a preallocated array).
+So decoding, filtering and storing of different images overlap.
+The time spent in each stage is returned to check the bottlenecks
+"""
+import sys
+import time
+import threading
+import Queue
+
+STAGES = ['decode', 'filter', 'store']
+
+def loadFrames(indexes, decode, filterImage, store, n_workers=4, prefetch=16):
+    """
+    loadFrames(indexes, decode, filterImage, store, n_workers=4, prefetch=16)
+
+    Decode, filter and store the images in a pipeline of threads
+
+    Parameters:
+    ---------------
+    indexes : list
+        The indexes of the images to load
+    decode : function
+        decode(index) returns the raw image
+    filterImage : function
+        filterImage(image) returns the filtered image
+    store : function
+        store(index, image) saves the filtered image,
+        as in out[:,:,index] = image
+    n_workers : int
+        Number of threads of the decoding stage,
+        and of the filtering/storing stage
+    prefetch : int
+        Maximum number of decoded images waiting to be filtered
+
+    Returns:
+    -----------
+    timings : dict
+        Time (s) spent in each stage ('decode', 'filter', 'store'),
+        summed over the threads, and the total time ('total')
+    """
+    startTime = time.time()
+    timings = dict([(stage, 0.) for stage in STAGES])
+    lock = threading.Lock()
+    toDecode = Queue.Queue()
+    for index in indexes:
+        toDecode.put(index)
+    decoded = Queue.Queue(max(1, prefetch))
+    errors = []
+
+    def addTime(stage, t0):
+        with lock:
+            timings[stage] += time.time() - t0
+
+    def decoder():
+        while not errors:
+            try:
+                index = toDecode.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                t0 = time.time()
+                image = decode(index)
+                addTime('decode', t0)
+            except Exception:
+                errors.append(sys.exc_info())
+                image = None
+            decoded.put((index, image))
+
+    def filterer():
+        while True:
+            index, image = decoded.get()
+            if index is None:
+                return
+            if errors:
+                continue
+            try:
+                t0 = time.time()
+                image = filterImage(image)
+                addTime('filter', t0)
+                t0 = time.time()
+                store(index, image)
+                addTime('store', t0)
+            except Exception:
+                errors.append(sys.exc_info())
+
+    n_workers = max(1, n_workers)
+    decoders = [threading.Thread(target=decoder) for i in range(n_workers)]
+    filterers = [threading.Thread(target=filterer) for i in range(n_workers)]
+    for thread in decoders + filterers:
+        thread.daemon = True
+        thread.start()
+    for thread in decoders:
+        thread.join()
+    for thread in filterers:
+        decoded.put((None, None))
+    for thread in filterers:
+        thread.join()
+    if errors:
+        excType, excValue, excTraceback = errors[0]
+        raise excType, excValue, excTraceback
+    timings['total'] = time.time() - startTime
+    return timings
+
+def printTimings(timings):
+    stages = ", ".join(["%s %.2f s" % (stage, timings[stage]) for stage in STAGES])
+    print "Loading times (summed over threads): %s; total %.2f s" % (stages, timings['total'])
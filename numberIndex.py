@@ -0,0 +1,71 @@
+"""
+Lookup between the numbers of the images and their indexes in the stack
+
+When the images are numbered contiguously (the usual case), the index
+is calculated as number - first number; otherwise a dict is used
+for the single numbers, and a sorted copy of the numbers
+(with np.searchsorted) for the arrays of numbers
+"""
+import numpy as np
+
+class NumberIndex:
+    """
+    Numbers of the images of a stack, in the order of the stack
+
+    Parameters:
+    ---------------
+    numbers : sequence of int
+        The numbers of the images
+    """
+    def __init__(self, numbers):
+        self.numbers = np.array(numbers, dtype=np.int64)
+        self._setLookup()
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def _setLookup(self):
+        numbers = self.numbers
+        n = len(numbers)
+        self.isContiguous = n == 0 or (numbers[-1] - numbers[0] == n - 1 and np.all(np.diff(numbers) == 1))
+        if self.isContiguous:
+            self._first = int(numbers[0]) if n else 0
+            self._index, self._order, self._sorted = None, None, None
+        else:
+            self._index = dict(zip(numbers.tolist(), range(n)))
+            self._order = np.argsort(numbers, kind='mergesort')
+            self._sorted = numbers[self._order]
+
+    def extend(self, numbers):
+        """
+        Append the numbers of new images
+        """
+        self.numbers = np.concatenate((self.numbers, np.asarray(numbers, dtype=np.int64)))
+        self._setLookup()
+
+    def indexToNumber(self, indexes):
+        """
+        Numbers of the images at indexes (int or array of ints)
+        """
+        return self.numbers[indexes]
+
+    def numberToIndex(self, numbers):
+        """
+        Indexes of the images with numbers (int or array of ints);
+        -1 for the numbers not in the stack
+        """
+        n = len(self.numbers)
+        if np.isscalar(numbers):
+            if self.isContiguous:
+                index = int(numbers) - self._first
+                return index if 0 <= index < n else -1
+            return self._index.get(int(numbers), -1)
+        numbers = np.asarray(numbers, dtype=np.int64)
+        if self.isContiguous:
+            indexes = numbers - self._first
+            isIn = (indexes >= 0) & (indexes < n)
+        else:
+            positions = np.minimum(np.searchsorted(self._sorted, numbers), n - 1)
+            isIn = self._sorted[positions] == numbers
+            indexes = self._order[positions]
+        return np.where(isIn, indexes, -1)
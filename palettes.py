@@ -0,0 +1,99 @@
+"""
+Palettes of the color images of the switch times
+
+All the colors of a palette are calculated at once as a (n_colors, 3)
+uint8 array of RGB values; the color image is obtained indexing
+the palette with the 2D array of the switch times (see renderRgb)
+"""
+import numpy as np
+
+PALETTES = ['korean', 'randomKorean', 'random', 'randomHue']
+NO_SWITCH_COLORS = {'black': (0, 0, 0), 'white': (255, 255, 255)}
+
+def hsvToRgb(h, s, v):
+    """
+    Vectorized colorsys.hsv_to_rgb: h, s, v (arrays or scalars) in [0,1]
+    Returns an array (..., 3) of the r, g, b values in [0,1]
+    """
+    h, s, v = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64) for x in (h, s, v)])
+    i = np.floor(h * 6.).astype(int)
+    f = h * 6. - i
+    p, q, t = v * (1. - s), v * (1. - s * f), v * (1. - s * (1. - f))
+    i = i % 6
+    r = np.choose(i, [v, q, p, p, t, v])
+    g = np.choose(i, [t, v, v, q, p, p])
+    b = np.choose(i, [p, p, t, v, v, q])
+    return np.stack((r, g, b), axis=-1)
+
+def koreanPalette(n_colors):
+    """
+    Palette in the korean style: from red to green to blue
+    """
+    n = np.arange(n_colors) / float(n_colors) * 3.
+    R = (n <= 1.) + (2. - n) * (n > 1.) * (n <= 2.)
+    G = n * (n <= 1.) + (n > 1.) * (n <= 2.) + (3. - n) * (n > 2.)
+    B = (n - 1.) * (n >= 1.) * (n < 2.) + (n >= 2.)
+    return (np.column_stack((R, G, B)) * 255).astype(np.uint8)
+
+def randomHuePalette(n_colors, rnd=np.random):
+    """
+    Equally spaced colors in the hue wheel (with random brightness), randomly permuted
+    """
+    rgb = hsvToRgb(np.arange(n_colors) / float(n_colors), 1, rnd.uniform(0.75, 1, n_colors))
+    return rnd.permutation((rgb * 255).astype(np.uint8))
+
+def getPalette(palette, n_colors, korean=None, rnd=np.random):
+    """
+    getPalette(palette, n_colors, korean=None, rnd=np.random)
+
+    Parameters:
+    ---------------
+    palette : string
+        'korean', 'randomKorean' (a random permutation of the korean palette),
+        'random' (random colors) or 'randomHue'
+    n_colors : int
+        The number of colors, i.e. of the images with switches
+    korean : ndarray, opt
+        The korean palette of n_colors, if already calculated
+
+    Returns:
+    -----------
+    palette : ndarray (n_colors, 3) of uint8
+    """
+    if palette in ['korean', 'randomKorean'] and korean is None:
+        korean = koreanPalette(n_colors)
+    if palette == 'korean':
+        return korean
+    elif palette == 'randomKorean':
+        return rnd.permutation(korean)
+    elif palette == 'random':
+        return rnd.randint(0, 256, (n_colors, 3)).astype(np.uint8)
+    elif palette == 'randomHue':
+        return randomHuePalette(n_colors, rnd)
+    raise ValueError("Palette %s not available" % palette)
+
+def renderRgb(switchTimes2D, palette, noSwitchColor='black'):
+    """
+    renderRgb(switchTimes2D, palette, noSwitchColor='black')
+
+    Color image of the switch times
+
+    Parameters:
+    ---------------
+    switchTimes2D : ndarray of int
+        The switch times starting from 0, as StackImages._switchTimes2D;
+        the pixels not switched are -1
+    palette : ndarray (n_colors, 3)
+        The colors of the switch times
+    noSwitchColor : string or tuple
+        'black', 'white' or the RGB color of the pixels not switched
+
+    Returns:
+    -----------
+    image : ndarray (dimX, dimY, 3) of uint8
+    """
+    if isinstance(noSwitchColor, str):
+        noSwitchColor = NO_SWITCH_COLORS[noSwitchColor]
+    # The last color of the table is used by the index -1
+    lut = np.vstack((np.asarray(palette, dtype=np.uint8), np.asarray(noSwitchColor, dtype=np.uint8)))
+    return lut[switchTimes2D]
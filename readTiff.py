@@ -0,0 +1,140 @@
+"""
+Fast reading of 16-bit TIFF images
+
+For uncompressed images the contiguous strips of raw data are read
+directly from the file into a preallocated numpy array (with readinto),
+without converting the pixels to python objects.
+Compressed images are decoded by PIL and converted
+with np.frombuffer on the raw bytes.
+The original dtype (uint16) is kept.
+Multi-page TIFF stacks are read in one open with imreadStack
+(StackImages uses it when the pattern matches a single multi-page file)
+"""
+import numpy as np
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+# dtypes of the raw modes of PIL for 16-bit images
+RAW_DTYPES = {'I;16': '<u2', 'I;16L': '<u2', 'I;16B': '>u2', 'I;16N': '=u2'}
+
+def _getRawOffset(im):
+    """
+    Return the offset in the file of the raw data of the current page,
+    or None if the data are not stored as contiguous raw strips
+    """
+    tiles = sorted(im.tile, key=lambda tile: tile[1][1])
+    sizeX, sizeY = im.size
+    if not tiles:
+        return None
+    offset = tiles[0][2]
+    nextOffset, nextRow = offset, 0
+    for decoder, (x0, y0, x1, y1), tileOffset, args in tiles:
+        rawmode, stride = args[0], args[1]
+        if decoder != 'raw' or rawmode != im.mode or stride not in (0, 2 * sizeX):
+            return None
+        if (x0, x1) != (0, sizeX) or y0 != nextRow or tileOffset != nextOffset:
+            return None
+        nextRow = y1
+        nextOffset = tileOffset + (y1 - y0) * sizeX * 2
+    if nextRow != sizeY:
+        return None
+    return offset
+
+def _readPage(im, f, out=None):
+    """
+    Read the current page of the PIL image im as a 2D array of uint16,
+    reading the raw data from the open file f directly in the array if possible
+
+    Parameters:
+    ---------------
+    im : PIL image
+    f : file
+        The open file of the image
+    out : ndarray, opt
+        Contiguous 2D array of uint16 where the page is read
+    """
+    sizeX, sizeY = im.size
+    dtype = np.dtype(RAW_DTYPES[im.mode])
+    if out is None:
+        out = np.empty((sizeY, sizeX), dtype=np.uint16)
+    offset = _getRawOffset(im)
+    if offset is not None:
+        f.seek(offset)
+        if f.readinto(out) != out.nbytes:
+            raise IOError("Truncated image data")
+        if not dtype.isnative:
+            out.byteswap(True)
+    else:
+        im.load()
+        if hasattr(im, 'tobytes'):
+            rawData = im.tobytes()
+        else:
+            rawData = im.tostring()
+        out[:] = np.frombuffer(rawData, dtype=dtype).reshape(sizeY, sizeX)
+    return out
+
+def isTiff16(im):
+    return im.mode in RAW_DTYPES
+
+def imread16(fileName):
+    """
+    Read a 16-bit TIFF image as a 2D array of uint16
+    """
+    with open(fileName, 'rb') as f:
+        im = Image.open(f)
+        if not isTiff16(im):
+            raise ValueError("%s is not a 16-bit image (mode %s)" % (fileName, im.mode))
+        return _readPage(im, f)
+
+def _countPages(im):
+    """
+    Number of pages of the open PIL image im
+    """
+    n_pages = getattr(im, 'n_frames', None)
+    if n_pages is None:
+        # Old versions of PIL: seek until the end of the file
+        n_pages = 1
+        while True:
+            try:
+                im.seek(n_pages)
+            except EOFError:
+                break
+            n_pages += 1
+        im.seek(0)
+    return n_pages
+
+def getNumberOfPages(fileName):
+    """
+    Number of pages of a 16-bit TIFF (0 for the other images)
+    """
+    with open(fileName, 'rb') as f:
+        im = Image.open(f)
+        if not isTiff16(im):
+            return 0
+        return _countPages(im)
+
+def imreadStack(fileName, pages=None):
+    """
+    Read the pages of a multi-page 16-bit TIFF
+    as a 3D array of uint16 (n_pages, sizeY, sizeX), opening the file once
+
+    Parameters:
+    ---------------
+    fileName : string
+    pages : sequence of int, opt
+        The indexes of the pages to be read (default: all the pages)
+    """
+    with open(fileName, 'rb') as f:
+        im = Image.open(f)
+        if not isTiff16(im):
+            raise ValueError("%s is not a 16-bit image (mode %s)" % (fileName, im.mode))
+        if pages is None:
+            pages = range(_countPages(im))
+        sizeX, sizeY = im.size
+        stack = np.empty((len(pages), sizeY, sizeX), dtype=np.uint16)
+        for k, page in enumerate(pages):
+            im.seek(page)
+            _readPage(im, f, stack[k])
+        return stack
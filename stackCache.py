@@ -0,0 +1,92 @@
+"""
+Cache on disk of the stacks of images loaded by StackImages
+
+The filtered stack is saved as a .npy file in the 'Cache' directory
+of the images, and loaded back as a memory-mapped array,
+so the images are decoded only once.
+The name of the file contains a key calculated on the names,
+sizes and modification times of the image files,
+and on the pattern, the filter (with its options), the sigma and the layout used
+(and the range of the pages of a multi-page TIFF)
+"""
+import os
+import glob
+import hashlib
+import numpy as np
+
+CACHE_DIR = "Cache"
+
+def getCacheKey(fileNames, pattern, filtering, sigma, layout='pixel', filterOptions=None, dtype=None, \
+                pages=None):
+    """
+    Return the key (as a hex string) of a stack
+
+    Parameters:
+    ---------------
+    fileNames : list
+        The full paths of the image files in the stack
+    pattern, filtering, sigma, layout :
+        as in StackImages
+    filterOptions : dict, opt
+        Other options of the filter (as filterMode and sigmaTime)
+    dtype : dtype, opt
+        The dtype of the decoded images
+    pages : sequence, opt
+        The numbers of the pages, for a stack of a multi-page TIFF
+    """
+    h = hashlib.md5()
+    for fileName in fileNames:
+        st = os.stat(fileName)
+        h.update("%s %i %r\n" % (os.path.basename(fileName), st.st_size, st.st_mtime))
+    h.update("%r %r %r" % (pattern, filtering, sigma))
+    if layout != 'pixel':
+        h.update(" %r" % layout)
+    if filterOptions:
+        h.update(" %r" % sorted(filterOptions.items()))
+    if dtype is not None:
+        h.update(" %s" % np.dtype(dtype).str)
+    if pages is not None:
+        h.update(" %i-%i" % (pages[0], pages[-1]))
+    return h.hexdigest()
+
+def getCacheFileName(mainDir, key):
+    return os.path.join(mainDir, CACHE_DIR, "stack_%s.npy" % key)
+
+def loadCache(mainDir, key):
+    """
+    Return the cached stack as a read-only memory-mapped array,
+    or None if the stack has not been cached
+    """
+    fileName = getCacheFileName(mainDir, key)
+    if not os.path.isfile(fileName):
+        return None
+    return np.load(fileName, mmap_mode='r')
+
+def createCache(mainDir, key, shape, dtype):
+    """
+    Create a memory-mapped array to be filled with the images.
+    The array is written in a temporary file, which is
+    moved to the cache by saveCache once all the images are loaded
+    """
+    cacheDir = os.path.join(mainDir, CACHE_DIR)
+    if not os.path.isdir(cacheDir):
+        os.mkdir(cacheDir)
+    fileName = getCacheFileName(mainDir, key) + ".part"
+    return np.lib.format.open_memmap(fileName, mode='w+', dtype=dtype, shape=shape)
+
+def saveCache(array, mainDir, key):
+    """
+    Flush the array created by createCache and move it to the cache.
+    Returns the cached stack as a read-only memory-mapped array
+    """
+    array.flush()
+    fileName = getCacheFileName(mainDir, key)
+    os.rename(fileName + ".part", fileName)
+    return loadCache(mainDir, key)
+
+def clearCache(mainDir):
+    """
+    Remove all the cached stacks of mainDir
+    """
+    for fileName in glob.glob(os.path.join(mainDir, CACHE_DIR, "stack_*.npy*")):
+        os.remove(fileName)
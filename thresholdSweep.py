@@ -0,0 +1,139 @@
+"""
+Avalanche statistics for many thresholds of the gray level step at once
+
+A pixel is switched when its step is >= threshold, so lowering the threshold
+only adds pixels. The steps are sorted once, the thresholds are scanned
+from the highest to the lowest, and at each threshold only the pixels
+newly admitted are processed: the switched pixels and the avalanche sizes
+of each frame are updated with np.bincount, and the clusters
+(connected pixels with the same switch time) with a union-find:
+each cluster is a tree of pixels, and the clusters touched by the new pixels
+are merged finding the connected components of the (small) graph
+of the clusters joined by the new pixels
+"""
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+
+def _getOffsets(NN):
+    offsets = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+    if NN == 8:
+        offsets += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    return offsets
+
+def _findRoots(root, pixels):
+    """
+    Roots of the clusters of the pixels, compressing their paths
+    """
+    roots = root[pixels]
+    while True:
+        parents = root[roots]
+        if np.array_equal(parents, roots):
+            break
+        roots = parents
+    root[pixels] = roots
+    return roots
+
+def sweepThresholds(switchTimes, switchSteps, shape, thresholds, NN=8):
+    """
+    sweepThresholds(switchTimes, switchSteps, shape, thresholds, NN=8)
+
+    Switched pixels, avalanches and clusters for a vector of thresholds
+
+    Parameters:
+    ---------------
+    switchTimes, switchSteps : ndarray
+        The switch times and the gray level steps of the pixels,
+        as StackImages._switchTimes and _switchSteps
+    shape : tuple
+        The shape (dimX, dimY) of the images
+    thresholds : sequence
+        The thresholds: a pixel is switched if its step >= threshold
+    NN : int
+        No of Nearest Neighbours (4 or 8) of the clusters
+
+    Returns:
+    -----------
+    sweep : dict, with the results in the order of the thresholds:
+        'thresholds'
+        'n_switched' : the number of switched pixels
+        'times' : the switch times (the frames with switches)
+        'avalancheSizes' : array (n_thresholds, n_times), the size of the avalanche of each frame
+        'n_clusters' : array (n_thresholds, n_times), the number of clusters of each frame
+        'clusterHistograms' : list of arrays, the number of clusters of each size
+        (to be used with incrementalAvalanches.logDistributionFromHistogram)
+    """
+    dimX, dimY = shape
+    switchTimes = np.asarray(switchTimes).ravel()
+    switchSteps = np.asarray(switchSteps).ravel()
+    n_pixels = switchTimes.size
+    thresholds = np.asarray(thresholds)
+    times, frames = np.unique(switchTimes, return_inverse=True)
+    n_times = len(times)
+    # Pixels in order of increasing step
+    order = np.argsort(switchSteps, kind='mergesort')
+    starts = np.searchsorted(switchSteps[order], thresholds, side='left')
+    # Each pixel is a cluster (with the pixel as root) when admitted
+    root = np.arange(n_pixels)
+    clusterSize = np.ones(n_pixels, dtype=np.int64)
+    isSwitched = np.zeros(n_pixels, dtype=bool)
+    avalancheSizes = np.zeros(n_times, dtype=np.int64)
+    n_clusters = np.zeros(n_times, dtype=np.int64)
+    sizeCounts = np.zeros(n_pixels + 1, dtype=np.int64)
+    maxSize = 0
+    offsets = _getOffsets(NN)
+    sweep = {'thresholds': thresholds, 'n_switched': n_pixels - starts, 'times': times,
+             'avalancheSizes': np.zeros((len(thresholds), n_times), dtype=np.int64),
+             'n_clusters': np.zeros((len(thresholds), n_times), dtype=np.int64),
+             'clusterHistograms': [None] * len(thresholds)}
+    stop = n_pixels
+    # Scan the thresholds from the highest to the lowest
+    for k in np.argsort(-thresholds, kind='mergesort'):
+        start = min(starts[k], stop)
+        pixels = order[start:stop]
+        stop = start
+        if len(pixels):
+            isSwitched[pixels] = True
+            newPerFrame = np.bincount(frames[pixels], minlength=n_times)
+            avalancheSizes += newPerFrame
+            n_clusters += newPerFrame
+            sizeCounts[1] += len(pixels)
+            maxSize = max(maxSize, 1)
+            # Switched neighbours with the same switch time
+            x, y = pixels // dimY, pixels % dimY
+            p, q = [], []
+            for dx, dy in offsets:
+                xn, yn = x + dx, y + dy
+                isIn = (xn >= 0) & (xn < dimX) & (yn >= 0) & (yn < dimY)
+                neighbours = xn[isIn] * dimY + yn[isIn]
+                isJoined = isSwitched[neighbours] & (switchTimes[neighbours] == switchTimes[pixels[isIn]])
+                p.append(pixels[isIn][isJoined])
+                q.append(neighbours[isJoined])
+            a = _findRoots(root, np.concatenate(p))
+            b = _findRoots(root, np.concatenate(q))
+            isDifferent = a != b
+            a, b = a[isDifferent], b[isDifferent]
+            if len(a):
+                # Merge the clusters connected by the new pixels
+                roots, index = np.unique(np.concatenate((a, b)), return_inverse=True)
+                n_roots = len(roots)
+                graph = sparse.coo_matrix((np.ones(len(a), dtype=np.int8), (index[:len(a)], index[len(a):])),
+                                          shape=(n_roots, n_roots))
+                n_groups, groups = connected_components(graph, directed=False)
+                sizes = clusterSize[roots]
+                groupSizes = np.bincount(groups, weights=sizes).astype(np.int64)
+                np.subtract.at(sizeCounts, sizes, 1)
+                np.add.at(sizeCounts, groupSizes, 1)
+                maxSize = max(maxSize, groupSizes.max())
+                # The largest cluster of each group is the new root
+                byGroup = np.lexsort((sizes, groups))
+                last = np.concatenate((np.flatnonzero(np.diff(groups[byGroup])), [n_roots - 1]))
+                groupRoots = roots[byGroup[last]]
+                root[roots] = groupRoots[groups]
+                clusterSize[groupRoots] = groupSizes
+                n_clusters -= np.bincount(frames[groupRoots], weights=np.bincount(groups) - 1,
+                                          minlength=n_times).astype(np.int64)
+        sweep['avalancheSizes'][k] = avalancheSizes
+        sweep['n_clusters'][k] = n_clusters
+        sweep['clusterHistograms'][k] = sizeCounts[:maxSize + 1].copy()
+    return sweep
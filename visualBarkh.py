@@ -1,5 +1,6 @@
 import os, sys, glob
 import re
+import json
 import scipy
 import scipy.ndimage as nd
 import scipy.signal as signal
@@ -8,14 +9,41 @@ import numpy as np
 import numpy.ma as ma
 import matplotlib as mpl
 import matplotlib.pyplot as plt
-from colorsys import hsv_to_rgb
 #import tables
 import Image
 import time
 import getLogDistributions as gLD
 reload(gLD)
-import getAxyLabels as gal
-reload(gal)
+import labelAvalanches as lA
+reload(lA)
+import readTiff
+reload(readTiff)
+import getSwitchTimes as gst
+reload(gst)
+import stackCache
+reload(stackCache)
+import loadImages
+reload(loadImages)
+import filterStack as fs
+reload(fs)
+import watchDir
+reload(watchDir)
+import growableStack
+reload(growableStack)
+import lazyStack
+reload(lazyStack)
+import numberIndex
+reload(numberIndex)
+import palettes
+reload(palettes)
+import thresholdSweep
+reload(thresholdSweep)
+import exportDiffs
+reload(exportDiffs)
+import frameIndex
+reload(frameIndex)
+import ghostDetection
+reload(ghostDetection)
 # Load scikits modules if available
 try:
     from skimage.filter import tv_denoise
@@ -28,15 +56,18 @@ try:
     class Imread_convert():
         def __init__(self, mode):
             self.mode = mode
+            # dtype of the decoded images
+            if mode in readTiff.RAW_DTYPES:
+                self.dtype = np.dtype(np.uint16)
+            else:
+                self.dtype = np.dtype(np.int16)
             
         def __call__(self, f):
-            if self.mode != "I;16":
+            if self.mode not in readTiff.RAW_DTYPES:
                 return im_io.imread(f).astype(np.int16)
             else:
-                im = Image.open(f)
-                imageList = list(im.getdata())
-                sizeX, sizeY = im.size
-                return np.asanyarray(imageList).reshape(sizeY, sizeX)
+                # 16-bit images are read as uint16 from the raw data
+                return readTiff.imread16(f)
 
     isScikits = True
 except:
@@ -56,11 +87,22 @@ else:
 
 
 filters = {'gauss': nd.gaussian_filter, 'fouriergauss': nd.fourier_gaussian, \
-           'median': nd.median_filter, 'wiener': signal.wiener}
+           'median': nd.median_filter, 'wiener': signal.wiener, \
+           'fftgauss': fs.fftGaussianFilter}
 
 if isTv_denoise:
     filters['tv'] = tv_denoise
 
+def _getFilterType(dtype):
+    """
+    Type of the images to be filtered: unsigned (16-bit) images
+    are filtered as int64, as the filters (i.e. wiener) square the values
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'u':
+        return np.dtype(np.int64)
+    return dtype
+
 # Adjust the interpolation scheme to show the images
 mpl.rcParams['image.interpolation'] = 'nearest'
 
@@ -80,6 +122,8 @@ class StackImages:
     pattern : string
         Pattern of the input image files, 
         as for instance "Data1-*.tif"
+        If it matches a single multi-page 16-bit TIFF, the pages
+        are the images, numbered from 1 (not with live, streaming or lazy)
     
     firstImage, lastImage : int, opt
        first and last image (included) to be loaded
@@ -95,19 +139,76 @@ class StackImages:
         'median': nd.median_filter, 
         'tv': tv_denoise, 
         'wiener': signal.wiener
+        'fftgauss': Gaussian filter with the real FFT (see filterStack)
         
     sigma : scalar or sequence of scalars, required with filtering
        for 'gauss': standard deviation for Gaussian kernel.
-       for 'fouriergauss': The sigma of the Gaussian kernel.
+       for 'fouriergauss' and 'fftgauss': The sigma of the Gaussian kernel.
        for 'median': the size of the filter
        for 'tv': denoising weight
        for 'wiener': A scalar or an N-length list giving the size of the Wiener filter
        window in each dimension.
+       
+    useCache : bool, opt
+       Save the loaded (and filtered) stack in the 'Cache' directory of mainDir,
+       and use it as a memory-mapped array in the next loads (see stackCache).
+       Default is True; the stack is loaded without the cache
+       if it cannot be written (e.g. a read-only mainDir).
+       Use False to avoid the copy of the stack on disk
+       
+    streaming : bool, opt
+       Do not load the stack in memory: the images are read in order
+       by getSwitchTimesAndSteps, for stacks larger than the memory.
+       self.Array is None in this mode
+       
+    loadWorkers : int, opt
+       Number of threads decoding and filtering the images (see loadImages)
+       
+    prefetch : int, opt
+       Maximum number of decoded images waiting to be filtered
+       
+    layout : string, opt
+       Storage of self.Array in memory:
+       'pixel' (default): (dimX, dimY, n_images), each pixel time sequence is contiguous
+       'frame': (n_images, dimX, dimY), each image is contiguous
+       self.shape is always (dimX, dimY, n_images)
+       
+    filterMode : string, opt
+       'image' (default): the filter is applied to each image while loading
+       'volume': chunks of images are filtered as a single array (see filterStack)
+       
+    sigmaTime : scalar, opt
+       With filterMode='volume', also filter along the time axis:
+       for 'gauss': standard deviation along the time
+       for 'median': size of the filter along the time
+       
+    filterChunk : int, opt
+       Number of images filtered at once with filterMode='volume'
+       
+    live : bool, opt
+       Live ingestion during the acquisition: the images are kept
+       in a growable preallocated stack, and the new images written
+       in mainDir are appended with self.refresh(), without reloading
+       the images already loaded. The last image of mainDir, which can be
+       still being written, is loaded by refresh (the cache is not used)
+       
+    lazy : bool, opt
+       Do not load the stack at init: self.Array is a lazyStack.LazyStack,
+       and the images are read and filtered only when requested
+       (as self[n] or by imDiff), keeping the last used ones in a cache.
+       The whole stack is loaded by the operations which need all the images
+       (getSwitchTimesAndSteps, pixelTimeSequence). Requires filterMode='image'
+       
+    cacheBytes : int, opt
+       Memory budget of the cache of the images in lazy mode
     """
         
     def __init__(self,mainDir,pattern, resize_factor=None, \
                  firstImage=None, lastImage=None,\
-                 filtering=None, sigma=None):
+                 filtering=None, sigma=None, useCache=True, streaming=False,\
+                 loadWorkers=4, prefetch=16, layout='pixel',\
+                 filterMode='image', sigmaTime=None, filterChunk=64, live=False,\
+                 lazy=False, cacheBytes=lazyStack.MAX_CACHE_BYTES):
         # Initialize variables
         self._mainDir = mainDir
         self._colorImage = None
@@ -115,12 +216,28 @@ class StackImages:
         self._isColorImage = False
         self._isSwitchAndStepsDone = False
         self._switchTimes = None
+        self._frameIndex = None
+        self._useKernel = 'step'
+        self._backend = None
         self._threshold = 0
         self._figTimeSeq = None
         self.figDiffs = None
         self._figHistogram = None
         self._figColorImage = None
         self._figColorImage2 = None
+        if layout not in ['pixel', 'frame']:
+            raise ValueError("Layout %s not available" % layout)
+        self._layout = layout
+        if live and streaming:
+            raise ValueError("Live ingestion needs the images in memory (streaming=False)")
+        if live and sigmaTime:
+            raise ValueError("sigmaTime is not available with live ingestion")
+        self._live = live
+        if lazy and (live or streaming):
+            raise ValueError("Lazy loading is not available with live ingestion or streaming")
+        if lazy and filterMode != 'image':
+            raise ValueError("Lazy loading requires filterMode='image'")
+        self._lazy = lazy
         if lastImage == None:
             lastImage = -1
         # Make a kernel as a step-function
@@ -140,8 +257,23 @@ class StackImages:
             sys.exit()
         else:
             print "Found %d images in %s" % (len(imageFileNames), mainDir)
-        # Search the number of all the images given the pattern above
-        _imageNumbers = [int(patternCompiled.sub("",fn)) for fn in imageFileNames]
+        n_pages = 0
+        if len(imageFileNames) == 1:
+            n_pages = readTiff.getNumberOfPages(os.path.join(mainDir, imageFileNames[0]))
+        isMultiPage = n_pages > 1
+        if isMultiPage and (live or streaming or lazy):
+            raise ValueError("A multi-page TIFF is read at once: live, streaming and lazy are not available")
+        if live and lastImage == -1 and len(imageFileNames) > 1:
+            # The last image could be still being written
+            lastImage = -2
+        if isMultiPage:
+            # The pages of the file are the images
+            print "Found %d pages in %s" % (n_pages, imageFileNames[0])
+            _imageNumbers = range(1, n_pages + 1)
+            imageFileNames = imageFileNames * n_pages
+        else:
+            # Search the number of all the images given the pattern above
+            _imageNumbers = [int(patternCompiled.sub("",fn)) for fn in imageFileNames]
         # Search the indexes where there are the first and the last images to be loaded
         if firstImage is None:
             firstImage = _imageNumbers[0]
@@ -154,7 +286,8 @@ class StackImages:
             print("Error: range of the images is %s-%s (%s-%s chosen)" % (i0,i1,firstImage, lastImage))
             sys.exit()
         # Save the list of numbers of the images to be loaded
-        self.imageNumbers = _imageNumbers[indexFirst:indexLast+1]
+        self._numberIndex = numberIndex.NumberIndex(_imageNumbers[indexFirst:indexLast+1])
+        self.imageNumbers = self._numberIndex.numbers
         self.imageIndex = []
         print "First image: %s" % imageFileNames[indexFirst]
         print "Last image: %s" % imageFileNames[indexLast]
@@ -165,9 +298,7 @@ class StackImages:
         print "Loading images: "
         load_pattern = [os.path.join(mainDir,ifn) for ifn in imageFileNames[indexFirst:indexLast+1]]
         
-        if isScikits:
-            imageCollection = im_io.ImageCollection(load_pattern, load_func=imread_convert)
-        else:
+        if not isScikits:
             sys.exit()
         if filtering:
             filtering = filtering.lower()
@@ -178,40 +309,295 @@ class StackImages:
                 print "Filter: %s" % filtering
                 if filtering == 'wiener':
                     sigma = [sigma, sigma]
-                self.Array = np.dstack([np.int16(filters[filtering](im,sigma)) for im in imageCollection])
+        self._imageFileNames = load_pattern
+        self._imread_convert = imread_convert
+        self._pages = None
+        if isMultiPage:
+            self._pages = readTiff.imreadStack(load_pattern[0], range(indexFirst, indexLast + 1))
+        self._filtering, self._sigma = filtering, sigma
+        if filterMode not in ['image', 'volume']:
+            raise ValueError("Filter mode %s not available" % filterMode)
+        if sigmaTime and filterMode != 'volume':
+            raise ValueError("sigmaTime requires filterMode='volume'")
+        self._filterMode, self._sigmaTime = filterMode, sigmaTime
+        self._filterChunk = filterChunk
+        if streaming:
+            self.Array = None
+            first_image, last_image = self._readImage(0), self._readImage(-1)
+            self.shape = first_image.shape + (len(load_pattern),)
+        elif lazy:
+            self._loadArgs = pattern, useCache, loadWorkers, prefetch
+            self.Array = lazyStack.LazyStack(self._readImage, len(load_pattern), cacheBytes)
+            first_image, last_image = self._getFrame(0), self._getFrame(-1)
+            self.shape = first_image.shape + (len(load_pattern),)
         else:
-            self.Array = np.dstack([im for im in imageCollection])
-        self.shape = self.Array.shape 
+            self.Array = self._loadImages(pattern, useCache and not live, loadWorkers, prefetch)
+            first_image, last_image = self._getFrame(0), self._getFrame(-1)
+            self.shape = first_image.shape + (len(load_pattern),)
+        if live:
+            self._watcher = watchDir.DirectoryWatcher(mainDir, pattern, lastImage=self.imageNumbers[-1])
         self.dimX, self.dimY, self.n_images = self.shape
-        print "%i image(s) loaded, of %i ximport skimage.io as io %i pixels" % (self.n_images, self.dimX, self.dimY)
+        print "%i image(s) loaded, of %i x %i pixels" % (self.n_images, self.dimX, self.dimY)
         # Check for the grey direction
-        grey_first_image = scipy.mean(self.Array[:,:,0].flatten())
-        grey_last_image = scipy.mean(self.Array[:,:,-1].flatten())
+        grey_first_image = scipy.mean(first_image.flatten())
+        grey_last_image = scipy.mean(last_image.flatten())
         print "grey scale: %i, %i" % (grey_first_image, grey_last_image)
         if grey_first_image > grey_last_image:
             self.kernel = -self.kernel
             self.kernel0 = -self.kernel0
 
+    def _decodeImage(self, index):
+        """
+        Decode the image at index of the sequence of files
+        (or of the pages of a multi-page TIFF)
+        """
+        if self._pages is not None:
+            return self._pages[index]
+        return self._imread_convert(self._imageFileNames[index])
+
+    def _filterImage(self, im):
+        if self._filtering:
+            im = im.astype(_getFilterType(im.dtype), copy=False)
+            return np.int16(filters[self._filtering](im, self._sigma))
+        else:
+            return im
+
+    def _readImage(self, index):
+        """
+        Read and filter the image at index of the sequence of files
+        """
+        return self._filterImage(self._decodeImage(index))
+
+    def _loadImages(self, pattern, useCache, loadWorkers=4, prefetch=16):
+        """
+        Load and filter the images as a 3D array (dimX, dimY, n_images),
+        or (n_images, dimX, dimY) with the 'frame' layout.
+        The images are decoded and filtered in a pipeline of threads,
+        and stored directly in the preallocated array.
+        With filterMode='volume' the images are filtered in chunks (see _loadVolumes).
+        With useCache, the array is taken from the cache of the stack if available,
+        otherwise it is written in the cache while loading
+        """
+        fileNames = self._imageFileNames
+        if useCache:
+            filterOptions = None
+            if self._filtering and self._filterMode == 'volume':
+                filterOptions = {'filterMode': self._filterMode, 'sigmaTime': self._sigmaTime}
+            pages = None
+            if self._pages is not None:
+                pages = self.imageNumbers
+            cacheKey = stackCache.getCacheKey(fileNames, pattern, self._filtering, self._sigma, \
+                                              self._layout, filterOptions, self._imread_convert.dtype, pages)
+            array = stackCache.loadCache(self._mainDir, cacheKey)
+            if array is not None:
+                print "Images loaded from the cache"
+                return array
+        im = self._readImage(0)
+        if self._layout == 'frame':
+            shape = (len(fileNames),) + im.shape
+        else:
+            shape = im.shape + (len(fileNames),)
+        array = None
+        if useCache:
+            try:
+                array = stackCache.createCache(self._mainDir, cacheKey, shape, im.dtype)
+            except (IOError, OSError) as e:
+                print "Warning: the cache cannot be written (%s), loading without it" % e
+                useCache = False
+        if array is None and self._live:
+            self._stack = growableStack.GrowableStack(im.shape, im.dtype, self._layout, 2 * len(fileNames))
+            array = self._stack.extend(len(fileNames))
+        elif array is None:
+            array = np.empty(shape, dtype=im.dtype)
+        def store(index, im):
+            if self._layout == 'frame':
+                array[index] = im
+            else:
+                array[:,:,index] = im
+        if self._filtering and self._filterMode == 'volume':
+            timings = self._loadVolumes(array, loadWorkers, prefetch)
+        else:
+            store(0, im)
+            timings = loadImages.loadFrames(range(1, len(fileNames)), self._decodeImage, self._filterImage, \
+                                            store, loadWorkers, prefetch)
+        loadImages.printTimings(timings)
+        if useCache:
+            try:
+                array = stackCache.saveCache(array, self._mainDir, cacheKey)
+            except (IOError, OSError) as e:
+                print "Warning: the cache cannot be saved (%s)" % e
+        return array
+
+    def _loadVolumes(self, array, loadWorkers=4, prefetch=16):
+        """
+        Load the raw images in chunks of self._filterChunk images,
+        filter each chunk as a volume and store it in the array.
+        The raw and filtered chunks use two preallocated buffers;
+        with sigmaTime, the chunks include a halo of images on each side.
+        Returns the timings of the stages
+        """
+        startTime = time.time()
+        n_images = len(self._imageFileNames)
+        halo = fs.getHalo(self._filtering, self._sigmaTime)
+        im = self._decodeImage(0)
+        if self._layout == 'frame':
+            timeAxis = 0
+        else:
+            timeAxis = -1
+        timings = dict([(stage, 0.) for stage in loadImages.STAGES + ['total']])
+        buffers = {}
+        for f0 in range(0, n_images, self._filterChunk):
+            f1 = min(f0 + self._filterChunk, n_images)
+            h0, h1 = max(f0 - halo, 0), min(f1 + halo, n_images)
+            # Reuse the buffers for chunks of the same size
+            if h1 - h0 not in buffers:
+                buffers.clear()
+                if timeAxis == 0:
+                    shape = (h1 - h0,) + im.shape
+                else:
+                    shape = im.shape + (h1 - h0,)
+                dtype = _getFilterType(im.dtype)
+                buffers[h1 - h0] = np.empty(shape, dtype=dtype), np.empty(shape, dtype=dtype)
+            raw, filtered = buffers[h1 - h0]
+            if self._filtering not in ['gauss', 'median']:
+                filtered = None
+            def store(index, image):
+                if timeAxis == 0:
+                    raw[index - h0] = image
+                else:
+                    raw[:,:,index - h0] = image
+            chunkTimings = loadImages.loadFrames(range(h0, h1), self._decodeImage, lambda image: image, \
+                                                 store, loadWorkers, prefetch)
+            t0 = time.time()
+            filtered = fs.filterVolume(raw, self._filtering, self._sigma, timeAxis, self._sigmaTime, \
+                                       filtered, filters)
+            chunkTimings['filter'] += time.time() - t0
+            t0 = time.time()
+            if timeAxis == 0:
+                array[f0:f1] = filtered[f0 - h0:f1 - h0]
+            else:
+                array[:,:,f0:f1] = filtered[:,:,f0 - h0:f1 - h0]
+            chunkTimings['store'] += time.time() - t0
+            for stage in loadImages.STAGES:
+                timings[stage] += chunkTimings[stage]
+        timings['total'] = time.time() - startTime
+        return timings
+
+    def refresh(self, includeLast=False, loadWorkers=4, prefetch=16):
+        """
+        Append the new images of mainDir to the stack (live ingestion),
+        in the order of their numbers.
+        The previous results of the analysis have to be calculated again
+
+        Parameters:
+        ---------------
+        includeLast : bool
+            Also load the image with the highest number,
+            i.e. the acquisition is over
+
+        Returns:
+        -----------
+        n_new : int
+            The number of new images
+        """
+        if not self._live:
+            raise ValueError("refresh requires live=True")
+        imageNumbers, fileNames = self._watcher.poll(includeLast)
+        if not imageNumbers:
+            return 0
+        n0 = self.n_images
+        self.Array = self._stack.extend(len(fileNames))
+        self._imageFileNames = self._imageFileNames + fileNames
+        self._numberIndex.extend(imageNumbers)
+        self.imageNumbers = self._numberIndex.numbers
+        if self._filtering and self._filterMode == 'volume':
+            # Without sigmaTime, the same of filtering each image
+            filterImage = lambda im: fs.filterVolume(im.astype(_getFilterType(im.dtype))[np.newaxis], \
+                                                     self._filtering, self._sigma, 0, \
+                                                     filters=filters)[0]
+        else:
+            filterImage = self._filterImage
+        timings = loadImages.loadFrames(range(n0, n0 + len(fileNames)), self._decodeImage, filterImage, \
+                                        self._stack.setFrame, loadWorkers, prefetch)
+        self.shape = self.shape[:2] + (len(self.imageNumbers),)
+        self.dimX, self.dimY, self.n_images = self.shape
+        self._isSwitchAndStepsDone = False
+        self._isColorImage = False
+        print "%i new image(s) loaded (%i-%i) in %.2f s" % (len(imageNumbers), imageNumbers[0], \
+                                                            imageNumbers[-1], timings['total'])
+        return len(imageNumbers)
+
     def __get__(self):
         return self.Array
         
+    def _getFrame(self, index):
+        """Get the image at index of the Array, for both the layouts"""
+        if self.Array is None:
+            # Streaming mode: read the image
+            return self._readImage(index)
+        elif isinstance(self.Array, lazyStack.LazyStack):
+            return self.Array.getFrame(index)
+        elif self._layout == 'frame':
+            return self.Array[index]
+        else:
+            return self.Array[:,:,index]
+
+    def _getFrames(self, k0, k1):
+        """
+        Get the images from index k0 to k1-1 as an array (k1-k0, dimX, dimY),
+        reading only them in streaming and lazy mode
+        """
+        if self.Array is None:
+            return np.array([self._readImage(k) for k in range(k0, k1)])
+        elif isinstance(self.Array, lazyStack.LazyStack):
+            return np.array([self.Array.getFrame(k) for k in range(k0, k1)])
+        elif self._layout == 'frame':
+            return self.Array[k0:k1]
+        else:
+            return np.rollaxis(self.Array[:,:,k0:k1], 2)
+
+    def _loadArray(self):
+        """
+        Load the whole stack in lazy mode, for the operations
+        which need all the images
+        """
+        if isinstance(self.Array, lazyStack.LazyStack):
+            print "Loading the whole stack"
+            self.Array.clear()
+            self.Array = self._loadImages(*self._loadArgs)
+        return self.Array
+
     def __getitem__(self,n):
         """Get the n-th image"""
         index = self._getImageIndex(n)
         if index is not None:
-            return self.Array[:,:,index]
+            return self._getFrame(index)
 
     def _getImageIndex(self,n):
         """
         check if image number n has been loaded
         and return the index of it in the Array
         """
-        ns = self.imageNumbers
-        try:
-            return ns.index(n)
-        except:
+        index = self._numberIndex.numberToIndex(n)
+        if index < 0:
+            ns = self.imageNumbers
             print "Image number %i is out of the range (%i,%i)" % (n, ns[0], ns[-1])
             return None
+        return index
+
+    def indexToNumber(self, indexes):
+        """
+        Return the image numbers of the indexes of the stack
+        (int or array, as the switches of getSwitchTimes)
+        """
+        return self._numberIndex.indexToNumber(indexes)
+
+    def numberToIndex(self, numbers):
+        """
+        Return the indexes in the stack of the image numbers
+        (int or array, as self._switchTimes); -1 if not loaded
+        """
+        return self._numberIndex.numberToIndex(numbers)
         
     def showRawImage(self, imageNumber, plugin='mpl'):
         """
@@ -280,8 +666,15 @@ class StackImages:
         else:
             print 'Method not implement yet'
             return None
-        leftLevel = np.int(np.mean(pxTimeSeq[lowPoint:switch - 1*(kernel=='zero')])+0.5)
-        rigthLevel = np.int(np.mean(pxTimeSeq[switch:highPoint])+0.5)
+        leftSeq = pxTimeSeq[lowPoint:switch - 1*(kernel=='zero')]
+        rightSeq = pxTimeSeq[switch:highPoint]
+        # An empty window takes the level of the other one (see getSwitchTimes._getMeanLevels)
+        if not len(leftSeq):
+            leftSeq = rightSeq
+        if not len(rightSeq):
+            rightSeq = leftSeq
+        leftLevel = np.int(np.mean(leftSeq)+0.5)
+        rigthLevel = np.int(np.mean(rightSeq)+0.5)
         levels = leftLevel, rigthLevel 
         return levels
     
@@ -298,7 +691,15 @@ class StackImages:
            The (x,y) pixel of the image, as (row, column)
         """
         x,y = pixel
-        return self.Array[x,y,:]
+        if self.Array is None:
+            # Streaming mode: read the images in chunks
+            return np.concatenate([self._getFrames(k0, min(k0 + self._filterChunk, self.n_images))[:,x,y] \
+                                   for k0 in range(0, self.n_images, self._filterChunk)])
+        self._loadArray()
+        if self._layout == 'frame':
+            return self.Array[:,x,y]
+        else:
+            return self.Array[x,y,:]
         
     def showPixelTimeSequence(self,pixel=(0,0),newPlot=False):
         """
@@ -364,6 +765,8 @@ class StackImages:
             with scipy.ndimage.convolve1d is available
         """
         pxTimeSeq = self.pixelTimeSequence(pixel)
+        # Signed type for unsigned (16-bit) images, as in getSwitchTimes
+        pxTimeSeq = pxTimeSeq.astype(gst._getConvolutionType(pxTimeSeq.dtype))
         if method == "convolve1d":
             if useKernel == 'step' or useKernel == 'both':
                 convolution_of_stepKernel = nd.convolve1d(pxTimeSeq,self.kernel)
@@ -396,7 +799,7 @@ class StackImages:
             raise RuntimeError("Method not yet implemented")            
         levels = self._getLevels(pxTimeSeq, switch, kernel_to_use)
         # Now redefine the switch using the correct image number
-        switch = self.imageNumbers[switch]
+        switch = int(self.indexToNumber(switch))
         return switch, levels
 
     def _imDiff(self, imNumbers, invert=False):
@@ -411,15 +814,10 @@ class StackImages:
         """
         i, j = imNumbers
         try:
-            im = self[i]-self[j]
+            im = np.subtract(self[i], self[j], dtype=np.int32)
         except:
             return 
-        if invert:
-            im = 255 - im
-        imMin = scipy.amin(im)
-        imMax = scipy.amax(im)
-        im = scipy.absolute(im-imMin)/float(imMax-imMin)*255
-        return scipy.array(im,dtype='int16')
+        return exportDiffs.normalizeDiffs(im[np.newaxis], invert)[0].astype(np.int16)
 
     def showTwoImageDifference(self, imNumbers, invert=False):
         """Show the output of self._imDiff
@@ -441,7 +839,7 @@ class StackImages:
         except:
             return
         
-    def imDiffSave(self,imNumbers='all', invert=False, mainDir=None):
+    def imDiffSave(self,imNumbers='all', invert=False, mainDir=None, fileFormat='tif', n_workers=4, chunkSize=32):
         """
         Save the difference(s) between a series of images
         
@@ -453,62 +851,119 @@ class StackImages:
         * when a tuple of two number (i.e., (i, j), 
         all the differences of the images between i and j (included)
         are saved
+        
+        fileFormat : string, opt
+        'tif': a file imDiff_j_i.tif for each difference
+        'multipage': a single multi-page TIFF
+        'npy': a single 3D array of uint8 (n_diffs, dimX, dimY)
+        (see exportDiffs.exportDiffs)
+        
+        n_workers : int, opt
+        Number of threads writing the tif files
+        
+        chunkSize : int, opt
+        Number of differences calculated at once
         """
         if mainDir == None:
             mainDir = self._mainDir
         dirSeq = os.path.join(mainDir,"Diff")
-        if not os.path.isdir(dirSeq):
-            os.mkdir(dirSeq)
         if imNumbers == 'all':
-            imRange = self.imageNumbers[:-1]
+            k0, k1 = 0, self.n_images - 1
         else:
             im0, imLast = imNumbers
-            imRange = range(im0, imLast)
-            if im0 >= imLast:
+            k0, k1 = self.numberToIndex(im0), self.numberToIndex(imLast)
+            if im0 >= imLast or k0 < 0 or k1 < 0:
                 print "Error: sequence not valid"
                 return
-        for i in imRange:
-            im = self._imDiff((i+1,i))
-            imPIL = scipy.misc.toimage(im)
-            fileName = "imDiff_%i_%i.tif" % (i+1,i)
-            print fileName
-            imageFileName = os.path.join(dirSeq, fileName)
-            imPIL.save(imageFileName)
+        getFrames = lambda i, j: self._getFrames(k0 + i, k0 + j)
+        fileNames = exportDiffs.exportDiffs(getFrames, self.imageNumbers[k0:k1+1], dirSeq, fileFormat, invert, \
+                                            n_workers, chunkSize)
+        print "%i difference(s) saved in %s" % (k1 - k0, dirSeq)
+        return fileNames
 
-    def getSwitchTimesAndSteps(self):
+    def getSwitchTimesAndSteps(self, useKernel='step', n_workers=1, backend=None):
         """
         Calculate the switch times and the gray level changes
         for each pixel in the image sequence.
+        The whole stack is analysed at once with getSwitchTimes,
+        with the same results of getSwitchTime called on each pixel
         It calculates:
         self._switchTimes
         self._switchSteps
+        
+        Parameters:
+        ---------------
+        useKernel : string
+            step, zero or both, as in getSwitchTime
+        n_workers : int, opt
+            Number of processes analysing tiles of rows in parallel
+            None uses all the CPU cores
+        backend : string, opt
+            'numpy', 'numba' or 'cuda' find the switches as gpuSwitchtime
+            (see cpuSwitchtime); None uses scipy.ndimage.convolve1d
+        
+        In streaming mode the images are read one by one
+        and analysed with getSwitchTimes.SwitchTimesStream
+        (n_workers and backend are not used)
         """
-        switchTimes = []
-        switchSteps = []
-        startTime = time.time()
-        # ####################
-        # TODO: make here a parallel calculus
-        for x in range(self.dimX):
-            # Print current row
-            if not (x+1)%10:
-                strOut = 'Analysing row:  %i/%i on %f seconds\r' % (x+1, self.dimX, time.time()-startTime)
-                sys.stderr.write(strOut)
-                #sys.stdout.flush()
-                startTime = time.time()
-            for y in range(self.dimY):
-                switch, levels = self.getSwitchTime((x,y))
-                grayChange = np.abs(levels[0]- levels[1])
-                if switch == 0: # TODO: how to deal with steps at zero time
-                    print x,y
-                switchTimes.append(switch)
-                switchSteps.append(grayChange)
-        print "\n"
-        self._switchTimes = np.asarray(switchTimes)
-        self._switchSteps = np.asarray(switchSteps)
+        width = self._getWidth()
+        if self.Array is None:
+            # Streaming mode: read the images in order
+            stream = gst.SwitchTimesStream(self.kernel, self.kernel0, useKernel, width)
+            for k in range(self.n_images):
+                stream.addFrame(self._readImage(k))
+            switches, switchSteps = stream.finish()
+        else:
+            self._loadArray()
+            if self._layout == 'frame':
+                timeAxis = 0
+            else:
+                timeAxis = -1
+            switches, switchSteps = gst.getSwitchTimesAndSteps(self.Array, self.kernel, self.kernel0, \
+                                                               useKernel, width, n_workers=n_workers, \
+                                                               backend=backend, timeAxis=timeAxis)
+        # Now redefine the switches using the correct image numbers
+        switchTimes = self.indexToNumber(switches)
+        for index in np.nonzero(switchTimes == 0)[0]: # TODO: how to deal with steps at zero time
+            print index / self.dimY, index % self.dimY
+        self._switchTimes = switchTimes
+        self._frameIndex = None
+        self._switchSteps = switchSteps
+        self._useKernel = useKernel
+        if self.Array is None:
+            backend = None
+        self._backend = backend
         self._isColorImage = True
         self._isSwitchAndStepsDone = True
         return
 
+    def _getFrameIndex(self):
+        """
+        Index of the pixels of each switch time (see frameIndex.FrameIndex),
+        calculated once after the switch times
+        """
+        if self._frameIndex is None:
+            self._frameIndex = frameIndex.FrameIndex(self._switchTimes)
+        return self._frameIndex
+
+    def _getFramePixels(self, imageNumber, threshold=None):
+        """
+        Flat indexes of the pixels switching at imageNumber
+        with a gray level change >= threshold (default: self._threshold)
+        """
+        if threshold is None:
+            threshold = self._threshold
+        pixels = self._getFrameIndex().getPixels(imageNumber)
+        return pixels[self._switchSteps[pixels] >= threshold]
+
+    def _getFrameImage(self, imageNumber, threshold=None):
+        """
+        Image of the pixels switching at imageNumber (1 if switched, 0 otherwise)
+        """
+        im = np.zeros(self.dimX * self.dimY, dtype=np.int16)
+        im[self._getFramePixels(imageNumber, threshold)] = 1
+        return im.reshape(self.dimX, self.dimY)
+
     def _getSwitchTimesArray(self, threshold=0, isFirstSwitchZero=False, fillValue=-1):
         """
         _getSwitchTimesArray(threshold=0)
@@ -539,19 +994,6 @@ class StackImages:
         switchTimes = maskedSwitchTimes.filled(fillValue) # Isn't it fantastic?
         return switchTimes
 
-    def _getKoreanColors(self, switchTime, n_images=None):
-        """
-        Make a palette in the korean style
-        """
-        if not n_images:
-            n_images = self.n_images
-        n = float(switchTime)/float(n_images)*3.
-        R = (n<=1.)+ (2.-n)*(n>1.)*(n<=2.)
-        G = n*(n<=1.)+ (n>1.)*(n<=2.)+(3.-n)*(n>2.)
-        B = (n-1.)*(n>=1.)*(n<2.)+(n>=2.)
-        R, G, B = [int(i*255) for i in [R,G,B]]
-        return R,G,B
-    
     def _isColorImageDone(self,ask=True):
         print "You must first run the getSwitchTimesAndSteps script: I'll do that for you"
         if ask:
@@ -578,6 +1020,10 @@ class StackImages:
         ----------
         self._switchTimes2D as a 2D array of the switchTime 
         with steps >= threshold, and first image number set to 0
+        
+        Returns:
+        -----------
+        colorImage : the RGB image (dimX, dimY, 3) of uint8, also set as self._colorImage
         """
         if not threshold:
             threshold = 0
@@ -592,30 +1038,18 @@ class StackImages:
         print "Gray changes are between %s and %s" % (min(self._switchSteps), max(self._switchSteps))
 
         # Calculate the colours, considering the range of the switch values obtained 
-        if self._koreanPalette is None:
+        if self._koreanPalette is None or len(self._koreanPalette) != nImagesWithSwitch:
             # Prepare the Korean Palette
-            self._koreanPalette = np.array([self._getKoreanColors(i, nImagesWithSwitch) for i in range(nImagesWithSwitch)])            
-            
-        if palette == 'korean':
-            pColor = self._koreanPalette
-        elif palette == 'randomKorean':
-            pColor = np.random.permutation(self._koreanPalette)
-        elif palette == 'random':
-            pColor = np.random.randint(0, 256, self._koreanPalette.shape)
-        elif palette == 'randomHue': 
-            # Use equally spaced colors in the HUE weel, and
-            # then randomize
-            pColor = [hsv_to_rgb(j/float(nImagesWithSwitch),1, np.random.uniform(0.75,1)) for j in range(nImagesWithSwitch)]
-            pColor = np.random.permutation(pColor)
-        if noSwitchColor == 'black':
-            noSwitchColorValue = 3*[0]
-        elif noSwitchColor == 'white':
-            noSwitchColorValue = 3*[255]
+            self._koreanPalette = palettes.koreanPalette(nImagesWithSwitch)
+        pColor = palettes.getPalette(palette, nImagesWithSwitch, self._koreanPalette)
+        noSwitchColorValue = palettes.NO_SWITCH_COLORS[noSwitchColor]
+        self._palette, self._noSwitchColorValue = pColor, noSwitchColorValue
         self._pColors = np.concatenate(([noSwitchColorValue], pColor))/255.
         self._colorMap = mpl.colors.ListedColormap(self._pColors, 'pColorMap')
         #Calculate the switch time Array (2D) considering the threshold and the start from zero
         self._switchTimes2D = self._getSwitchTimesArray(threshold, True, -1).reshape(self.dimX, self.dimY)
-        return
+        self._colorImage = palettes.renderRgb(self._switchTimes2D, pColor, noSwitchColorValue)
+        return self._colorImage
 
     
     def showColorImage(self, threshold=None, palette='random', noSwitchColor='black', ask=False):
@@ -707,7 +1141,7 @@ class StackImages:
         makes color image and saves
         """
         self._colorImage = self.getColorImage(threshold, palette,noSwitchColor)
-        imOut = scipy.misc.toimage(self._colorImage)
+        imOut = Image.fromarray(self._colorImage)
         imOut.save(fileName)
         
     def saveImage(self, figureNumber):
@@ -736,9 +1170,8 @@ class StackImages:
         """
         if not self._isColorImage:
             self._isColorImageDone(ask=False)
-        imDC = (self._switchTimes2D==imageNum)*1
+        imDC = self._getFrameImage(imageNum + self.min_switch)
         if haveColors:
-            imDC = scipy.array(imDC,dtype='int16')
             structure = [[0, 1, 0], [1,1,1], [0,1,0]]
             l, n = nd.label(imDC,structure)
             im_io.imshow(l,plt.cm.prism)
@@ -749,7 +1182,7 @@ class StackImages:
         return None
     
     def showRawAndCalcImages(self, n, threshold=0):
-        if self._switchTimes == None:
+        if self._switchTimes is None:
             print("Need to calculate the color image first")
             return
         if n in self._switchTimes:
@@ -760,7 +1193,7 @@ class StackImages:
             plt.title("Fig. %s, Original" % n)
             plt.grid(color='blue', ls="-")
             plt.subplot(1,2,2)
-            switchTimes_images = self._getSwitchTimesArray(threshold, fillValue=0).reshape(self.dimX, self.dimY) == n
+            switchTimes_images = self._getFrameImage(n, threshold)
             cl = self._pColors[n - self.min_switch]
             myMap = mpl.colors.ListedColormap([(0,0,0),cl],'mymap',2)
             plt.imshow(switchTimes_images, myMap)
@@ -805,42 +1238,36 @@ class StackImages:
             figCluster.set_size_inches(12, 8, forward=True)
             i0 = [0,1,1] # Index of the first raw image
             i1 = [-1,0,-1] # Index of the second raw image
-        n_of_images_with_ghosts = []
-        images_with_ghosts = {}
         structure = [[1, 1, 1], [1,1,1], [1,1,1]]
+        # Number of clusters of all the images, and of the union of each image with the next,
+        # with a single labeling (see ghostDetection)
+        isSwitched = (self._switchSteps >= self._threshold).reshape(self.dimX, self.dimY)
+        times, n_clusters, n_joint = ghostDetection.getGhostStatistics(self._switchTimes.reshape(self.dimX, self.dimY), \
+                                                                       isSwitched, NN=8)
         if imageNumber:
-            iterator = np.asarray([imageNumber, imageNumber+1]) - self.min_switch
             clusterThreshold = 0
+            ghosts_images = [imageNumber]
         else:
-            iterator = np.unique(self._switchTimes2D)
-        # Calculates the set of switches
-        for imageNumber0 in iterator:
-            im0 = (self._switchTimes2D==imageNumber0)*1
-            im0 = scipy.array(im0, dtype="int16")
-            array_labels, n_clusters = nd.label(im0, structure)
-            if n_clusters >= clusterThreshold:
-                imageNumber = imageNumber0 + self.min_switch
-                n_of_images_with_ghosts.append(imageNumber)
-                images_with_ghosts[imageNumber] = array_labels, n_clusters
-        # Now evaluate spongy avalanches and check if number of clusters is reduced
-        # Let us do it first on consecutive images belonging to n_of_images_with_ghosts
-        gh = scipy.asarray(n_of_images_with_ghosts)
-        # Consider consecutive images only
-        ghosts_images = gh[gh[1:] == gh[:-1]+1]
+            # Consider consecutive spongy images only
+            ghosts_images = ghostDetection.findGhosts(times, n_clusters, n_joint, clusterThreshold)[0]
         if len(ghosts_images) == 0:
             print("Warning, no images to consider")
             return
+        clustersOfImage = dict(zip(times, n_clusters))
+        jointClustersOfImage = dict(zip(times, n_joint))
         for ghi in ghosts_images:
-            image1, n1 = images_with_ghosts[ghi]
-            image2, n2 = images_with_ghosts[ghi+1]
-            new_array = scipy.array(image1+image2, dtype="int16")
-            image3, n3 = nd.label(new_array, structure)
+            n2 = clustersOfImage.get(ghi+1, 0)
+            n3 = jointClustersOfImage.get(ghi, n2)
             if showImages:
+                # Label the images to be shown
+                image1, n1 = nd.label(self._getFrameImage(ghi), structure)
+                image2, n2 = nd.label(self._getFrameImage(ghi+1), structure)
+                image3, n3 = nd.label(self._getFrameImage(ghi) + self._getFrameImage(ghi+1), structure)
                 for i, results in enumerate(zip([image1, image2, image3],[n1, n2, n3])):
                     im, clusters = results
                     plt.subplot(2, 3, i+1)
                     # Prepare the palette, from red to magenta (see hue weel for details)
-                    myPalette = [(0,0,0)] + [hsv_to_rgb(j/float(clusters),1,1) for j in range(clusters)]
+                    myPalette = [(0,0,0)] + palettes.hsvToRgb(np.arange(clusters)/float(clusters),1,1).tolist()
                     plt.imshow(im, mpl.colors.ListedColormap(myPalette))
                     imageNum = str(ghi+i)*(i<2) + (i==2)*"joint"
                     plt.title("Image: %s, N. clusters: %i" % (imageNum, clusters))
@@ -854,11 +1281,13 @@ class StackImages:
                     joinImages = False
             if (n3 < clusterThreshold and not showImages) or (showImages and joinImages):
                 print("Joining images %i and %i" % (ghi, ghi + 1))
-                whereChange = self._switchTimes==ghi
+                index = self._getFrameIndex()
+                whereSwitched = self._getFramePixels(ghi)
                 # Update the 'untouched' array of switch times
-                self._switchTimes[whereChange] = ghi + 1
+                self._switchTimes[index.getPixels(ghi)] = ghi + 1
+                index.mergeWithNext(ghi)
                 # Update the array with threshold and zero time at the beginning
-                self._switchTimes2D[whereChange.reshape(self.dimX, self.dimY)] = ghi + 1 - self.min_switch
+                self._switchTimes2D.ravel()[whereSwitched] = ghi + 1 - self.min_switch
         # Add the image without ghosts to the original one
         self._figColorImage = self._plotColorImage(self._switchTimes2D, self._colorMap, fig=self._figColorImage)
         self._plotHistogram(self._switchTimes)
@@ -898,21 +1327,25 @@ class StackImages:
         # Check if color Image is available
         if not self._isColorImage:
             self._isColorImageDone(ask=False)        
-        switchTimesMasked = self._switchTimes2D
-        pixelsUnderMasks = []
-        # first identify first 10 avalanches of whole image
-        firstAvsList = np.unique(self._switchTimes2D)[:11]
-        # Prepare the mask
-        m = np.ones((self.dimX, self.dimY))
-        # Top mask
-        mask = np.rot90(np.triu(m)) * np.triu(m)
-        top = switchTimesMasked * mask
-        pixelsUnderMasks.append(sum([np.sum(top==elem) for elem in firstAvsList]))
-        # Now we need to rotate the mask
-        for i in range(3):
-            mask = np.rot90(mask)
-            top = switchTimesMasked * mask
-            pixelsUnderMasks.append(sum([np.sum(top==elem) for elem in firstAvsList]))
+        # first identify the pixels of the first avalanches of whole image
+        firstAvsPixels = []
+        for imageNumber in self._getFrameIndex().times:
+            pixels = self._getFramePixels(imageNumber, threshold)
+            if len(pixels):
+                firstAvsPixels.append(pixels)
+            if len(firstAvsPixels) == 11:
+                break
+        pixels = np.concatenate(firstAvsPixels + [np.array([], dtype=np.int64)])
+        # Triangular masks between the diagonals (the pixels on the diagonals are in both),
+        # with integer coordinates scaled by (dimX-1)*(dimY-1)
+        x = pixels // self.dimY * (self.dimY - 1)
+        y = pixels % self.dimY * (self.dimX - 1)
+        c = (self.dimX - 1) * (self.dimY - 1)
+        isAbove, isBelow = y >= x, y <= x
+        isFirstHalf, isSecondHalf = x + y <= c, x + y >= c
+        # Top, left, bottom, right masks
+        masks = [isAbove & isFirstHalf, isBelow & isFirstHalf, isBelow & isSecondHalf, isAbove & isSecondHalf]
+        pixelsUnderMasks = [np.sum(mask) for mask in masks]
         max_in_mask = scipy.array(pixelsUnderMasks).argmax()
         return imageDirections[max_in_mask]
     
@@ -943,64 +1376,30 @@ class StackImages:
         if not self._isColorImage:
             self._isColorImageDone(ask=False)
         # Initialize variables
-        self.D_avalanches = []
-        self.D_cluster = scipy.array([], dtype='int32')
-        #self.N_cluster = {}
-        self.N_cluster = []
         self.dictAxy = {}
         self.dictAxy['aval'] = {}
         self.dictAxy['clus'] = {}
-        a0 = scipy.array([],dtype='int32')
         #Define the number of nearest neighbourg
-        if NN==8:
-            structure = [[1, 1, 1], [1,1,1], [1,1,1]]
-        else:
-            structure = [[0, 1, 0], [1,1,1], [0,1,0]]
-            if NN!=4:
-                print "N. of neibourgh not valid: assuming NN=4"
+        if NN not in (4, 8):
+            print "N. of neibourgh not valid: assuming NN=4"
+            NN = 4
         # Find the direction of the avalanches (left <-> right, top <-> bottom)
         self.imageDir = self._getImageDirection(self._threshold)
         print self.imageDir
         #
-        # Make a loop to calculate avalanche and clusters for each image
+        # Label avalanches and clusters of all the images in a single pass
         #
-        images = np.unique(self._switchTimes2D)
-        for imageNum in images: 
-            strOut = 'Analysing image n:  %i\r' % (imageNum + self.min_switch)
-            sys.stderr.write(strOut)
-            #sys.stdout.flush()
-            # Select the pixel flipped at the imageNum
-            im0 = (self._switchTimes2D == imageNum) * 1
-            im0 = scipy.array(im0, dtype="int16")
-            # Update the list of sizes of the global avalanche (i.e. for the entire image imageNum)
-            avalanche_size = scipy.sum(im0)
-            self.D_avalanches.append(avalanche_size)
-            # Find how many edges this avalanche touches
-            Axy = gal.getAxyLabels(im0, self.imageDir, edgeThickness)
-            Axy = Axy[0] # There is only one value for the whole image
-            # Update the dictionary of the avalanches
-            self.dictAxy['aval'][Axy] = scipy.concatenate((self.dictAxy['aval'].get(Axy,a0), [avalanche_size]))
-            # 
-            # Now move to cluster distributions
-            #
-            # Detect local clusters using scipy.ndimage method
-            array_labels, n_labels = nd.label(im0, structure)
-            # Make a list the sizes of the clusters
-            list_clusters_sizes = nd.sum(im0, array_labels, range(1, n_labels+1))
-            # Update the distributions
-            self.D_cluster = scipy.concatenate((self.D_cluster, list_clusters_sizes))
-            #self.N_cluster[avalanche_size] = scipy.concatenate((self.N_cluster.get(avalanche_size, a0), [n_labels]))
-            self.N_cluster.append(n_labels)
-            # Now find the Axy distributions (A00, A10, etc)
-            # First make an array of the edges each cluster touches
-            array_Axy = gal.getAxyLabels(array_labels, self.imageDir, edgeThickness)
-            # Note: we can restrict the choice to left and right edges (case of strip) using:
-            # array_Axy = [s[:2] for s in array_Axy]
-            # Now select each type of cluster ('0000', '0010', etc), make the S*P(S), and calculate the distribution
-            array_cluster_sizes = scipy.array(list_clusters_sizes, dtype='int32')
-            for Axy in np.unique(array_Axy):
-                sizes = array_cluster_sizes[array_Axy==Axy] # Not bad...
-                self.dictAxy['clus'][Axy] = scipy.concatenate((self.dictAxy['clus'].get(Axy,a0), sizes))
+        avalanches, clusters = lA.getAvalanchesAndClusters(self._switchTimes2D, self.imageDir,
+                                                           NN, edgeThickness)
+        self.D_avalanches = list(avalanches['sizes'])
+        self.N_cluster = list(avalanches['n_clusters'])
+        self.D_cluster = np.asarray(clusters['sizes'], dtype=np.float64)
+        for Axy in np.unique(avalanches['Axy']):
+            self.dictAxy['aval'][Axy] = avalanches['sizes'][avalanches['Axy'] == Axy]
+        # Sizes of the clusters are kept in the order of the images
+        array_cluster_sizes = np.asarray(clusters['sizes'], dtype='int32')
+        for Axy in np.unique(clusters['Axy']):
+            self.dictAxy['clus'][Axy] = array_cluster_sizes[clusters['Axy'] == Axy]
         print()
         print("Done")
         # Calculate and plot the distributions of clusters and avalanches
@@ -1020,6 +1419,149 @@ class StackImages:
         plt.xlabel("Avalanche size")
         plt.ylabel("N. of clusters")
         plt.show()
+
+    def sweepThresholds(self, thresholds, NN=8):
+        """
+        sweepThresholds(thresholds, NN=8)
+        
+        Calculate the switched pixels, the avalanche size and the number
+        of clusters of each frame and the histogram of the cluster sizes
+        for a vector of thresholds, reusing the switch times and steps
+        (see thresholdSweep.sweepThresholds)
+        
+        Parameters:
+        ---------------
+        thresholds : sequence
+        The minimum values of the gray level change at the switch
+        
+        NN : int
+        No of Nearest Neighbours around a pixel to consider two clusters
+        as touching or not
+        
+        Returns:
+        -----------
+        sweep : dict, as in thresholdSweep.sweepThresholds
+        """
+        if not self._isSwitchAndStepsDone:
+            self._isColorImageDone(ask=False)
+        if NN not in (4, 8):
+            print "N. of neibourgh not valid: assuming NN=4"
+            NN = 4
+        return thresholdSweep.sweepThresholds(self._switchTimes, self._switchSteps, (self.dimX, self.dimY), \
+                                              thresholds, NN)
+
+    def _getAnalysisParameters(self):
+        """
+        Parameters used to calculate the switch times (key 'switch')
+        and the color image and the distributions (key 'threshold')
+        """
+        switchParameters = {'kernel': self.kernel.tolist(), 'useKernel': self._useKernel, \
+                            'backend': self._backend, 'width': self._getWidth(), 'filtering': self._filtering, \
+                            'sigma': self._sigma, 'filterMode': self._filterMode, \
+                            'sigmaTime': self._sigmaTime, \
+                            'imageRange': [self.imageNumbers[0], self.imageNumbers[-1]]}
+        parameters = {'switch': switchParameters, 'threshold': self._threshold}
+        # Convert as saved in the file (i.e. tuples to lists)
+        return json.loads(json.dumps(parameters, default=lambda x: np.asarray(x).tolist()))
+
+    def _getResultsFileName(self, fileName):
+        if fileName is None:
+            fileName = "results_%i-%i.npz" % (self.imageNumbers[0], self.imageNumbers[-1])
+            fileName = os.path.join(self._mainDir, fileName)
+        return fileName
+
+    def save_results(self, fileName=None):
+        """
+        Save the results of the analysis and its parameters
+        (kernel, width, threshold, filter, sigma, image range)
+        in a compressed npz file
+
+        Parameters:
+        ---------------
+        fileName : string, opt
+            Default is results_firstImage-lastImage.npz in mainDir
+        """
+        if not self._isSwitchAndStepsDone:
+            print "Nothing to save: run getSwitchTimesAndSteps first"
+            return
+        fileName = self._getResultsFileName(fileName)
+        arrays = {'parameters': np.array(json.dumps(self._getAnalysisParameters()))}
+        for name in ['_switchTimes', '_switchSteps', '_switchTimes2D', \
+                     'D_avalanches', 'D_cluster', 'N_cluster', 'imageDir']:
+            value = getattr(self, name, None)
+            if value is not None:
+                arrays[name] = np.asarray(value)
+        if hasattr(self, 'dictAxy'):
+            for kind in self.dictAxy:
+                for Axy, sizes in self.dictAxy[kind].items():
+                    arrays["dictAxy/%s/%s" % (kind, Axy)] = sizes
+        np.savez_compressed(fileName, **arrays)
+        print "Results saved in %s" % fileName
+
+    def load_results(self, fileName=None, threshold=None):
+        """
+        Load the results saved by save_results.
+        The switch times and steps are loaded only if their parameters
+        (kernel, backend, width, filter, sigma, image range) are the same used here,
+        so that getSwitchTimesAndSteps is not needed.
+        The color image and the distributions are loaded
+        only if the threshold is the same too.
+        Returns True if the switch times have been loaded
+
+        Parameters:
+        ---------------
+        fileName : string, opt
+            Default is results_firstImage-lastImage.npz in mainDir
+        threshold : int, opt
+            The threshold of the color image and the distributions.
+            Default is the threshold of the saved results
+        """
+        fileName = self._getResultsFileName(fileName)
+        if not os.path.isfile(fileName):
+            print "No results in %s" % fileName
+            return False
+        # Copy the arrays out, so the file is closed
+        npz = np.load(fileName)
+        try:
+            data = dict((name, npz[name]) for name in npz.files)
+        finally:
+            npz.close()
+        savedParameters = json.loads(str(data['parameters']))
+        # The results saved without the backend used the default one
+        savedParameters['switch'].setdefault('backend', None)
+        if threshold is None:
+            threshold = savedParameters['threshold']
+        parameters = self._getAnalysisParameters()
+        if savedParameters['switch'] != parameters['switch']:
+            print "The results in %s have different parameters:" % fileName
+            print savedParameters['switch']
+            return False
+        self._switchTimes = data['_switchTimes']
+        self._frameIndex = None
+        self._switchSteps = data['_switchSteps']
+        self._useKernel = savedParameters['switch']['useKernel']
+        self._backend = savedParameters['switch']['backend']
+        self._isSwitchAndStepsDone = True
+        self._isColorImage = True
+        print "Switch times and steps loaded from %s" % fileName
+        if savedParameters['threshold'] != threshold or '_switchTimes2D' not in data:
+            return True
+        # Set the palette and the color map as well
+        self.getColorImage(threshold)
+        self._switchTimes2D = data['_switchTimes2D']
+        self._colorImage = palettes.renderRgb(self._switchTimes2D, self._palette, self._noSwitchColorValue)
+        if 'D_avalanches' in data:
+            self.D_avalanches = data['D_avalanches'].tolist()
+            self.D_cluster = data['D_cluster']
+            self.N_cluster = data['N_cluster'].tolist()
+            self.imageDir = str(data['imageDir'])
+            self.dictAxy = {'aval': {}, 'clus': {}}
+            for name in data:
+                if name.startswith('dictAxy/'):
+                    dictAxy, kind, Axy = name.split('/')
+                    self.dictAxy[kind][Axy] = data[name]
+            print "Distributions loaded"
+        return True
     
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+"""
+Detection of the new images written in a directory during an acquisition
+
+The directory is polled and the images matching the pattern
+(as "Data1-*.tif") which have not been seen yet are returned
+in the numeric order of their names.
+The image with the highest number can be still being written by the camera,
+so it is returned only when a following image appears
+(or when the acquisition is over).
+If pyinotify is available, the directory is listed only when files
+have been written, and an image closed by the camera is returned at once
+"""
+import os
+import re
+import fnmatch
+try:
+    import pyinotify
+    isInotify = True
+except ImportError:
+    isInotify = False
+
+class DirectoryWatcher:
+    """
+    Watch a directory for new images
+
+    Parameters:
+    ---------------
+    mainDir : string
+        Directory of the image files
+    pattern : string
+        Pattern of the input image files, as for instance "Data1-*.tif"
+    firstImage : int, opt
+        Number of the first image to consider
+    lastImage : int, opt
+        Number of the last image already read:
+        only the images after it are returned
+    useInotify : bool, opt
+        Use inotify (with pyinotify) to be notified of the written files,
+        instead of listing the directory at each poll
+    """
+    def __init__(self, mainDir, pattern, firstImage=None, lastImage=None, useInotify=True):
+        self.mainDir = mainDir
+        self.pattern = pattern
+        s = "(%s|%s)" % tuple(pattern.split("*"))
+        self._patternCompiled = re.compile(s)
+        self._firstImage = firstImage
+        # Number of the last image returned
+        self.lastImage = lastImage
+        self._notifier = None
+        if useInotify and isInotify:
+            # Names of the files closed after writing
+            self._closedFiles = set()
+            self._isChanged = True
+            watchManager = pyinotify.WatchManager()
+            self._notifier = pyinotify.Notifier(watchManager, self._addEvent, timeout=0)
+            watchManager.add_watch(mainDir, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+
+    def _addEvent(self, event):
+        self._closedFiles.add(event.name)
+        self._isChanged = True
+
+    def _isDirectoryChanged(self):
+        """
+        Process the inotify events and return True
+        if files have been written since the last poll
+        """
+        while self._notifier.check_events(timeout=0):
+            self._notifier.read_events()
+            self._notifier.process_events()
+        isChanged, self._isChanged = self._isChanged, False
+        return isChanged
+
+    def getImageNumber(self, fileName):
+        return int(self._patternCompiled.sub("", fileName))
+
+    def poll(self, includeLast=False):
+        """
+        Return the numbers and the full paths of the new images, in numeric order
+
+        Parameters:
+        ---------------
+        includeLast : bool
+            Also return the image with the highest number,
+            i.e. the acquisition is over
+        """
+        if self._notifier is not None and not self._isDirectoryChanged() and not includeLast:
+            return [], []
+        images = []
+        for fileName in fnmatch.filter(os.listdir(self.mainDir), self.pattern):
+            imageNumber = self.getImageNumber(fileName)
+            if self.lastImage is not None and imageNumber <= self.lastImage:
+                continue
+            if self._firstImage is not None and imageNumber < self._firstImage:
+                continue
+            images.append((imageNumber, os.path.join(self.mainDir, fileName)))
+        images.sort()
+        if images and not includeLast:
+            # The last image is complete only if it has been closed
+            if self._notifier is None or os.path.basename(images[-1][1]) not in self._closedFiles:
+                images = images[:-1]
+        if images:
+            self.lastImage = images[-1][0]
+        return [number for number, fileName in images], [fileName for number, fileName in images]